@@ -191,6 +191,10 @@ def main():
     parser.add_argument('--check-version', dest='checkversion', action='store_true',default=False,
                         help='check the last version of SSHScript (need internet)')
 
+    ## new on v2.0.3
+    parser.add_argument('--no-cache', dest='nocache', action='store_true',default=False,
+                        help='do not load or save converted .spy files in __pycache__')
+
     args, unknown = parser.parse_known_args()
     __main__.unknown_args = unknown
 
@@ -257,6 +261,9 @@ def main():
         if args.verbose:
             os.environ['VERBOSE'] = '1'
 
+        if args.nocache:
+            os.environ['SSHSCRIPT_CACHE'] = '0'
+
         setupLogger()
 
         if args.folder:
@@ -0,0 +1,272 @@
+# Copyright (C) 2022-2026  Hsin Yuan Yeh <iapyeh@gmail.com>
+#
+# This file is part of Sshscript.
+#
+# SSHScript is free software; you can redistribute it and/or modify it under the
+# terms of the MIT License.
+#
+# SSHScript is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the MIT License for more details.
+#
+# You should have received a copy of the MIT License along with SSHScript;
+# if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+'''
+Remote helper agent (v2.0.3)
+
+When enabled, a small python script (AGENT_SOURCE) is sent to the remote host
+through the stdin of a single exec_command() once per connection. It is not saved
+on the remote host. Then, commands are sent to it as framed requests over that
+long-lived channel, and their stdout, stderr, exitcode and timings are streamed
+back as framed responses. So, many commands can be pipelined without opening a
+channel for every command, and no prompt or idle timeout is required to know where
+the output of a command ends.
+
+A frame is a 4-bytes big-endian length of a json header, the header, then "size"
+bytes of payload.
+    request:  {"id":1,"command":"ls","env":{...},"cwd":"/tmp","size":len(stdin)} + stdin
+    response: {"id":1,"type":"stdout"|"stderr","size":n} + data
+              {"id":1,"type":"exit","exitcode":0,"elapsed":0.01,"size":0}
+Requests are executed in the order they were received, by "/bin/sh -c".
+
+Environment variables:
+    SSHSCRIPT_AGENT=1                : enable for one-dollar commands (or $.agent(True))
+    SSHSCRIPT_AGENT_PYTHON=python3   : python interpreter on the remote host
+'''
+import os
+import json
+import time
+import queue
+import struct
+import threading
+try:
+    from .sshscripterror import SSHScriptError, logDebug, logDebug8
+except ImportError:
+    from sshscripterror import SSHScriptError, logDebug, logDebug8
+
+def enabled():
+    return os.environ.get('SSHSCRIPT_AGENT','') not in ('','0','no','false')
+
+## runs on the remote host, it should work with python3 standard library only
+AGENT_SOURCE = r'''
+import os, sys, json, struct, time, threading, subprocess
+rfile = sys.stdin.buffer
+wfile = sys.stdout.buffer
+wlock = threading.Lock()
+def send(header, payload=b''):
+    header['size'] = len(payload)
+    data = json.dumps(header).encode()
+    with wlock:
+        wfile.write(struct.pack('>I', len(data)) + data + payload)
+        wfile.flush()
+def readexact(n):
+    buf = b''
+    while len(buf) < n:
+        chunk = rfile.read(n - len(buf))
+        if not chunk: return None
+        buf += chunk
+    return buf
+def pump(rid, fd, kind):
+    while True:
+        data = os.read(fd, 65536)
+        if not data: break
+        send({'id': rid, 'type': kind}, data)
+def run(req, stdin):
+    rid = req['id']
+    start = time.time()
+    env = dict(os.environ)
+    env.update(req.get('env') or {})
+    try:
+        p = subprocess.Popen(req['command'], shell=True, cwd=req.get('cwd') or None, env=env,
+            stdin=subprocess.PIPE if stdin else subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except Exception as e:
+        send({'id': rid, 'type': 'stderr'}, ('%s\n' % e).encode())
+        send({'id': rid, 'type': 'exit', 'exitcode': 127, 'elapsed': time.time() - start})
+        return
+    pumps = [threading.Thread(target=pump, args=(rid, p.stdout.fileno(), 'stdout')),
+             threading.Thread(target=pump, args=(rid, p.stderr.fileno(), 'stderr'))]
+    for t in pumps: t.start()
+    if stdin:
+        try:
+            p.stdin.write(stdin)
+            p.stdin.close()
+        except OSError:
+            pass
+    for t in pumps: t.join()
+    send({'id': rid, 'type': 'exit', 'exitcode': p.wait(), 'elapsed': time.time() - start})
+send({'type': 'hello', 'pid': os.getpid()})
+while True:
+    head = readexact(4)
+    if head is None: break
+    req = json.loads(readexact(struct.unpack('>I', head)[0]))
+    run(req, readexact(req['size']) if req.get('size') else b'')
+'''
+
+class AgentRequest(object):
+    ## returned by RemoteAgent.submit(), like a future of the command's result
+    def __init__(self,rid,command):
+        self.id = rid
+        self.command = command
+        self.exitcode = None
+        ## seconds of the execution on the remote host
+        self.elapsed = None
+        ## seconds from submitting to the exitcode was received
+        self.latency = None
+        self._submitted = time.time()
+        ## (type, data), type is "stdout", "stderr", "exit" or "error"
+        self._events = queue.Queue()
+        self._result = None
+        self._done = False
+
+    def __repr__(self):
+        return f'<AgentRequest {self.id}:{self.command},exitcode={self.exitcode}>'
+
+    def put(self,kind,data):
+        if kind == 'exit':
+            self.latency = time.time() - self._submitted
+        self._events.put((kind,data))
+
+    def iterOutput(self,timeout=None):
+        ## yields ("stdout", bytes) or ("stderr", bytes) until the command has completed.
+        ## timeout is the max seconds of waiting for the next output.
+        while not self._done:
+            try:
+                kind, data = self._events.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f'agent:{self.command}')
+            if kind == 'exit':
+                self.exitcode, self.elapsed = data
+                self._done = True
+            elif kind == 'error':
+                self._done = True
+                raise SSHScriptError(f'agent:{self.command};{data}')
+            else:
+                yield kind, data
+
+    def result(self,timeout=None):
+        ## returns (stdout, stderr, exitcode), like session('command')
+        if self._result is None:
+            stdout, stderr = [], []
+            for kind, data in self.iterOutput(timeout):
+                (stdout if kind == 'stdout' else stderr).append(data)
+            self._result = (b''.join(stdout).decode('utf8','replace'),b''.join(stderr).decode('utf8','replace'),self.exitcode)
+        return self._result
+
+class RemoteAgent(object):
+    def __init__(self,scheduler,timeout=60):
+        ## scheduler: the ChannelScheduler of the connection (see sshscriptscheduler)
+        python = os.environ.get('SSHSCRIPT_AGENT_PYTHON','python3')
+        source = AGENT_SOURCE.encode('utf8')
+        ## the source is read from stdin, then stdin continues with requests
+        command = f"{python} -c 'import sys;exec(sys.stdin.buffer.read({len(source)}))'"
+        self.scheduler = scheduler
+        self.channel = scheduler.openSession(timeout)
+        self.channel.exec_command(command)
+        self._stderr = self.channel.makefile_stderr('rb')
+        self._rfile = self.channel.makefile('rb')
+        self._sendLock = threading.Lock()
+        self._lock = threading.Lock()
+        self._counter = 0
+        self._requests = {}
+        self.closed = False
+        self.channel.settimeout(timeout)
+        try:
+            self.channel.sendall(source)
+            frame = self._readFrame()
+        except Exception:
+            frame = None
+        header = frame[0] if frame else None
+        if header is None or header.get('type') != 'hello':
+            error = self._readStderr()
+            self.channel.close()
+            scheduler.release(self.channel)
+            raise SSHScriptError(f'failed to start agent by {python}:{error}')
+        self.channel.settimeout(None)
+        self.pid = header['pid']
+        logDebug(f'[agent] started, remote pid={self.pid}')
+        self._thread = threading.Thread(target=self._run,name='sshscript-agent',daemon=True)
+        self._thread.start()
+        ## stderr of the agent shares the window of the channel, it must be drained,
+        ## otherwise the channel stalls once the agent has written enough warnings
+        threading.Thread(target=self._drainStderr,name='sshscript-agent-stderr',daemon=True).start()
+
+    def __repr__(self):
+        return f'<RemoteAgent pid={self.pid},pending={len(self._requests)}>'
+
+    def _readStderr(self):
+        try:
+            self.channel.settimeout(1)
+            return self._stderr.read().decode('utf8','replace').strip()
+        except Exception:
+            return ''
+
+    def _drainStderr(self):
+        try:
+            for line in self._stderr:
+                logDebug(f'[agent] stderr: {line.decode("utf8","replace").rstrip()}')
+        except Exception:
+            pass
+
+    def _readFrame(self):
+        ## returns (header, payload) or None if the channel was closed
+        head = self._rfile.read(4)
+        if len(head) < 4: return None
+        header = json.loads(self._rfile.read(struct.unpack('>I',head)[0]))
+        size = header.get('size',0)
+        payload = self._rfile.read(size) if size else b''
+        return header, payload
+
+    def _run(self):
+        try:
+            while True:
+                frame = self._readFrame()
+                if frame is None: break
+                header, payload = frame
+                request = self._requests.get(header.get('id'))
+                if request is None: continue
+                kind = header['type']
+                if kind == 'exit':
+                    with self._lock:
+                        self._requests.pop(request.id,None)
+                    request.put(kind,(header['exitcode'],header.get('elapsed')))
+                else:
+                    request.put(kind,payload)
+        except Exception as e:
+            logDebug(f'[agent] reading failed: {e}')
+        self.closed = True
+        logDebug8('[agent] closed')
+        with self._lock:
+            requests = list(self._requests.values())
+            self._requests.clear()
+        for request in requests:
+            request.put('error','agent closed')
+
+    def alive(self):
+        return not (self.closed or self.channel.closed)
+
+    def submit(self,command,env=None,cwd=None,stdin=None):
+        ## returns an AgentRequest immediately, requests can be submitted without waiting for results
+        if not self.alive(): raise SSHScriptError('agent closed')
+        if isinstance(stdin,str): stdin = stdin.encode('utf8')
+        stdin = stdin or b''
+        with self._lock:
+            self._counter += 1
+            request = AgentRequest(self._counter,command)
+            self._requests[request.id] = request
+        header = json.dumps({'id':request.id,'command':command,'env':env,'cwd':cwd,'size':len(stdin)}).encode('utf8')
+        with self._sendLock:
+            self.channel.sendall(struct.pack('>I',len(header)) + header + stdin)
+        logDebug8(f'[agent] submitted {request}')
+        return request
+
+    def close(self):
+        if self.channel.closed: return
+        try:
+            ## the agent exits when its stdin was closed
+            self.channel.shutdown_write()
+        except Exception:
+            pass
+        self.channel.close()
+        self.scheduler.release(self.channel)
@@ -0,0 +1,224 @@
+# Copyright (C) 2022-2026  Hsin Yuan Yeh <iapyeh@gmail.com>
+#
+# This file is part of Sshscript.
+#
+# SSHScript is free software; you can redistribute it and/or modify it under the
+# terms of the MIT License.
+#
+# SSHScript is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the MIT License for more details.
+#
+# You should have received a copy of the MIT License along with SSHScript;
+# if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+'''
+asyncio front-end of SSHScriptSession (v2.0.3)
+
+    session = SSHScriptSession()
+    session = await session.aconnect('user@host',password)
+    stdout, stderr, exitcode = await session.arun('ls -l')
+    results = await asyncio.gather(*[session.arun(f'ping -c 1 @{x}') for x in hosts])
+    async with session.ashell() as console:
+        await console.asendline('python3')
+        await console.aexpect('>>>')
+    await session.aclose()
+
+One-dollar commands run in the event loop. On remote hosts, the readiness of
+a channel (its fileno()) is awaited by loop.add_reader(), on the local host
+by asyncio.create_subprocess_exec(). So, thousands of concurrent commands need
+no thread per command. Blocking work of paramiko (connecting, opening channels,
+exec_command(), interactive shells) runs on a bounded thread pool.
+Two-dollars, and one-dollar by the agent, batch or local workers, run on the
+thread pool as they were called synchronously.
+
+Environment variables:
+    SSHSCRIPT_ASYNC_WORKERS=32    : max threads for blocking work
+'''
+import os
+import sys
+import time
+import shlex
+import asyncio
+import threading
+import functools
+import concurrent.futures
+try:
+    from .sshscriptdollar import SSHScriptDollar
+    from .sshscriptchannel import ParamikoChannel, POpenChannel
+    from .sshscripterror import logDebug
+except ImportError:
+    from sshscriptdollar import SSHScriptDollar
+    from sshscriptchannel import ParamikoChannel, POpenChannel
+    from sshscripterror import logDebug
+
+executor = None
+_executorLock = threading.Lock()
+def getExecutor():
+    global executor
+    with _executorLock:
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=int(os.environ.get('SSHSCRIPT_ASYNC_WORKERS',32)),
+                thread_name_prefix='sshscript-async')
+    return executor
+
+async def runBlocking(func,*args,**kw):
+    ## runs a blocking function on the thread pool
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(getExecutor(),functools.partial(func,*args,**kw))
+
+def _native(session,isTwodollars):
+    ## whether the dollar can run in the event loop
+    if isTwodollars or sys.platform == 'win32': return False
+    if session.host:
+        return not (session._useAgent or session._batch)
+    return not session._localWorker
+
+async def execDollar(session,script,isTwodollars,locals,globals):
+    ## like SSHScriptSession.execDollar(), returns (stdout, stderr, exitcode)
+    if not _native(session,isTwodollars):
+        return await runBlocking(session.execDollar,script,isTwodollars,locals,globals)
+    if '$.' in script:
+        locals = dict(locals,_c=session._lastDollar,_sshscript_in_context_=session)
+    dollar = SSHScriptDollar(session,script,globals,locals,inWith=False,fr=0)
+    cmds = dollar.evalCommand()
+    if session.host:
+        if cmds and cmds[0].startswith('#!'):
+            ## as execBySSH(), one-dollar ignores the shell
+            cmds.pop(0)
+        dollar.channel = ParamikoChannel(dollar,None)
+        execute = _execCommand
+    else:
+        cmds = [x for x in cmds if not x.startswith('#')]
+        dollar.channel = POpenChannel(dollar,None,None,None,None)
+        execute = _execSubprocess
+    try:
+        for command in cmds:
+            await execute(dollar,command)
+            dollar.lineOutputs.append((len(dollar.channel.stdoutOutput),len(dollar.channel.stderrOutput),dollar.exitcode))
+            error = dollar.checkExitcode(dollar.exitcode,dollar.channel.stderr)
+            if error: raise error
+    finally:
+        dollar.channel.close()
+        session._lastDollar = dollar
+    return dollar.stdout,dollar.stderr,dollar.exitcode
+
+async def _openSession(scheduler,timeout):
+    ## like scheduler.openSession(), but waits for a free slot in the event loop,
+    ## so queued commands do not hold threads of the pool
+    loop = asyncio.get_running_loop()
+    endtime = time.time() + timeout
+    while True:
+        future = loop.create_future()
+        ## future is registered atomically when no slot is available, it is resolved by scheduler.release()
+        channel = await runBlocking(scheduler.tryOpenOrWait,loop,future,timeout)
+        if channel is not None: return channel
+        remaining = endtime - time.time()
+        if remaining <= 0:
+            raise TimeoutError(f'no channel available in {timeout} seconds, {scheduler.stats()}')
+        await asyncio.wait([future],timeout=remaining)
+
+async def _execCommand(dollar,command):
+    ## exec_command() of a one-dollar line, as SSHScriptDollar.iterExecCommand() does
+    host = dollar.sshscript.host
+    timeout = dollar.commandTimeoutSSH
+    logDebug(f'[{host}]async exec_command:{command},timeout={timeout}')
+    loop = asyncio.get_running_loop()
+    scheduler = dollar.sshscript.scheduler
+    channel = await _openSession(scheduler,timeout)
+    try:
+        channel.settimeout(timeout)
+        await runBlocking(channel.exec_command,command)
+        ## channel.fileno() is readable when either stdout or stderr has data or the channel got eof
+        ready = asyncio.Event()
+        fd = channel.fileno()
+        loop.add_reader(fd,ready.set)
+        try:
+            while True:
+                received = False
+                if channel.recv_stderr_ready():
+                    dollar.channel.addStderrData(channel.recv_stderr(65536))
+                    received = True
+                if channel.recv_ready():
+                    dollar.channel.addStdoutData(channel.recv(65536))
+                    received = True
+                if received:
+                    continue
+                elif channel.eof_received or channel.closed:
+                    break
+                ready.clear()
+                try:
+                    await asyncio.wait_for(ready.wait(),timeout)
+                except asyncio.TimeoutError:
+                    dollar.channel.updateStdoutStderr('one-dollar timeout')
+                    raise TimeoutError(f'exec_command:{command};{dollar.channel.stderr}')
+        finally:
+            loop.remove_reader(fd)
+        if not channel.status_event.is_set():
+            ## the exit status usually arrives along with the eof
+            if not await runBlocking(channel.status_event.wait,timeout):
+                dollar.channel.updateStdoutStderr('one-dollar timeout')
+                raise TimeoutError(f'exec_command:{command};{dollar.channel.stderr}')
+        dollar.exitcode = channel.recv_exit_status()
+        logDebug(f'[{host}]exitcode={dollar.exitcode}')
+    finally:
+        channel.close()
+        scheduler.release(channel)
+
+async def _execSubprocess(dollar,command):
+    ## a one-dollar line on the local host, as SSHScriptDollar.iterSubprocess() does
+    logDebug(f'[subprocess] async exec:{command}')
+    process = await asyncio.create_subprocess_exec(*shlex.split(command),
+        stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.PIPE)
+    async def pump(stream,addData):
+        while True:
+            data = await stream.read(65536)
+            if not data: break
+            addData(data)
+    try:
+        await asyncio.gather(pump(process.stdout,dollar.channel.addStdoutData),pump(process.stderr,dollar.channel.addStderrData))
+        dollar.exitcode = await process.wait()
+    finally:
+        ## cancelled before the process completed
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+class AsyncConsole(object):
+    ## wraps the console of session.withdollar() for asyncio,
+    ## attributes other than the async methods are those of the console
+    def __init__(self,console):
+        self.console = console
+
+    def __getattr__(self,name):
+        return getattr(self.console,name)
+
+    async def asendline(self,*args,**kw):
+        return await runBlocking(self.console.sendline,*args,**kw)
+
+    async def aexpect(self,rawpat,timeout=None,stdout=True,stderr=True,position=0,silent=False):
+        return await self.console.channel.aexpect(rawpat,timeout,stdout,stderr,position,silent)
+
+    async def aexpectStderr(self,rawpat,timeout=None,position=0,silent=False):
+        return await self.console.channel.aexpect(rawpat,timeout,False,True,position,silent)
+
+    async def aexpectStdout(self,rawpat,timeout=None,position=0,silent=False):
+        return await self.console.channel.aexpect(rawpat,timeout,True,False,position,silent)
+
+    async def await_(self,seconds=None,timeout=0):
+        return await runBlocking(self.console.wait,seconds,timeout)
+
+class AsyncShell(object):
+    ## returned by session.ashell(), for "async with session.ashell() as console:"
+    def __init__(self,session,shell,locals,globals):
+        self.session = session
+        self.args = (shell,locals,globals)
+        self.channel = None
+
+    async def __aenter__(self):
+        self.channel = await runBlocking(self.session.withdollar,*self.args)
+        return AsyncConsole(self.channel.__enter__())
+
+    async def __aexit__(self,exc_type,exc_value,traceback):
+        await runBlocking(self.channel.__exit__,exc_type,exc_value,traceback)
@@ -0,0 +1,218 @@
+# Copyright (C) 2022-2026  Hsin Yuan Yeh <iapyeh@gmail.com>
+#
+# This file is part of Sshscript.
+#
+# SSHScript is free software; you can redistribute it and/or modify it under the
+# terms of the MIT License.
+#
+# SSHScript is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the MIT License for more details.
+#
+# You should have received a copy of the MIT License along with SSHScript;
+# if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+'''
+Benchmark of SFTP transfer options (v2.0.3)
+
+Uploads and downloads a file by $.upload() and $.download() against an
+in-process paramiko SFTP server, with every combination of the given transfer
+options (see sshscripttransfer), and prints their throughput. A proxy between
+the client and the server delays every packet, to simulate a high-latency link.
+Nothing but a temporary folder is touched.
+
+    python -m sshscript.sshscriptbenchmark --size 16 --latency 20 \\
+        --blocksize 32768,131072 --requests 0,16 --window 0,16777216
+
+benchmark() returns the results as a list of dicts, so it can be called by
+scripts to catch regressions, eg.
+
+    results = benchmark(size=8,latency=10)
+    assert min(x['MBps'] for x in results) > 1
+'''
+import os
+import time
+import queue
+import shutil
+import socket
+import tempfile
+import itertools
+import threading
+import paramiko
+try:
+    from .sshscriptsession import SSHScriptSession
+except ImportError:
+    from sshscriptsession import SSHScriptSession
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self,attr):
+        return paramiko.SFTP_OK
+
+class _SFTPServer(paramiko.SFTPServerInterface):
+    ## serves files in the folder of BenchmarkServer
+    root = None
+
+    def _path(self,path):
+        return os.path.join(self.root,os.path.normpath('/' + path).lstrip('/'))
+
+    def canonicalize(self,path):
+        return os.path.normpath('/' + path)
+
+    def stat(self,path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+    lstat = stat
+
+    def open(self,path,flags,attr):
+        try:
+            fd = os.open(self._path(path),flags,0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        handle = _SFTPHandle(flags)
+        handle.readfile = handle.writefile = os.fdopen(fd,'r+b' if flags & (os.O_WRONLY | os.O_RDWR) else 'rb')
+        return handle
+
+    def remove(self,path):
+        os.remove(self._path(path))
+        return paramiko.SFTP_OK
+
+class _ServerInterface(paramiko.ServerInterface):
+    def check_channel_request(self,kind,chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_auth_password(self,username,password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self,username):
+        return 'password'
+
+class BenchmarkServer(object):
+    ## an in-process SFTP server, with a proxy delaying packets by "latency" seconds in each direction
+    def __init__(self,latency=0):
+        self.latency = latency
+        self.root = tempfile.mkdtemp(prefix='sshscript-benchmark-')
+        self.hostKey = paramiko.RSAKey.generate(2048)
+        self.transports = []
+        self.closed = False
+        self._server = self._listen(self._serve)
+        self.port = self._listen(self._proxy).getsockname()[1] if latency else self._server.getsockname()[1]
+
+    def _listen(self,handler):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1',0))
+        sock.listen(16)
+        def accepting():
+            while not self.closed:
+                try:
+                    conn, _ = sock.accept()
+                except OSError:
+                    break
+                threading.Thread(target=handler,args=(conn,),daemon=True).start()
+        threading.Thread(target=accepting,daemon=True).start()
+        return sock
+
+    def _serve(self,conn):
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.hostKey)
+        handler = type('SFTPServer',(_SFTPServer,),{'root':self.root})
+        transport.set_subsystem_handler('sftp',paramiko.SFTPServer,handler)
+        transport.start_server(server=_ServerInterface())
+        self.transports.append(transport)
+
+    def _proxy(self,conn):
+        upstream = socket.create_connection(self._server.getsockname())
+        for src, dst in ((conn,upstream),(upstream,conn)):
+            self._delaying(src,dst)
+
+    def _delaying(self,src,dst):
+        ## data are forwarded after self.latency seconds since they were received
+        pending = queue.Queue()
+        def receiving():
+            while True:
+                try:
+                    data = src.recv(65536)
+                except OSError:
+                    data = b''
+                pending.put((time.time() + self.latency,data))
+                if not data: break
+        def sending():
+            while True:
+                due, data = pending.get()
+                delay = due - time.time()
+                if delay > 0: time.sleep(delay)
+                try:
+                    if not data:
+                        dst.shutdown(socket.SHUT_WR)
+                        break
+                    dst.sendall(data)
+                except OSError:
+                    break
+        threading.Thread(target=receiving,daemon=True).start()
+        threading.Thread(target=sending,daemon=True).start()
+
+    def close(self):
+        self.closed = True
+        for transport in self.transports:
+            transport.close()
+        self._server.close()
+        shutil.rmtree(self.root,ignore_errors=True)
+
+def benchmark(size=16,latency=0,blocksizes=(None,),requests=(None,),windows=(None,),packets=(None,),prefetch=True,verbose=False):
+    ## size: MB of the file, latency: milliseconds of one-way delay.
+    ## Returns [{'direction','blocksize','requests','window','packet','bytes','seconds','MBps'}, ...]
+    server = BenchmarkServer(latency / 1000)
+    session = SSHScriptSession()
+    localPath = os.path.join(server.root,'local.bin')
+    with open(localPath,'wb') as fd:
+        for _ in range(size):
+            fd.write(os.urandom(1 << 20))
+    results = []
+    try:
+        session = session.connect('benchmark@127.0.0.1',password='benchmark',port=server.port)
+        for blocksize, request, window, packet in itertools.product(blocksizes,requests,windows,packets):
+            options = {'blocksize':blocksize,'requests':request,'window':window,'packet':packet}
+            for direction in ('upload','download'):
+                if direction == 'upload':
+                    session.upload(localPath,'/remote.bin',**options)
+                else:
+                    session.download('/remote.bin',localPath + '.downloaded',prefetch=prefetch,**options)
+                stats = session.transferstats
+                result = dict(options,direction=direction,bytes=stats['bytes'],seconds=stats['seconds'],MBps=stats['MBps'])
+                results.append(result)
+                if verbose: print(_format(result),flush=True)
+    finally:
+        session.close()
+        server.close()
+    return results
+
+def _format(result):
+    def value(x):
+        return 'default' if x is None else str(x)
+    return (f"{result['direction']:<9}blocksize={value(result['blocksize']):<8}requests={value(result['requests']):<8}"
+        f"window={value(result['window']):<10}packet={value(result['packet']):<8}"
+        f"{result['seconds']:8.2f}s {result['MBps']:8.2f} MB/s")
+
+def main():
+    import argparse
+    def options(text):
+        ## "0" is paramiko's default
+        return [int(x) or None for x in text.split(',')]
+    parser = argparse.ArgumentParser(description='Benchmark of SFTP transfer options of SSHScript')
+    parser.add_argument('--size',type=int,default=16,help='MB of the transferred file (default 16)')
+    parser.add_argument('--latency',type=float,default=0,help='milliseconds of one-way delay (default 0)')
+    parser.add_argument('--blocksize',type=options,default=[None],help='comma-separated bytes of a request')
+    parser.add_argument('--requests',type=options,default=[None],help='comma-separated max outstanding requests')
+    parser.add_argument('--window',type=options,default=[None],help='comma-separated window sizes of the channel')
+    parser.add_argument('--packet',type=options,default=[None],help='comma-separated max packet sizes of the channel')
+    parser.add_argument('--no-prefetch',dest='prefetch',action='store_false',help='download without prefetching')
+    args = parser.parse_args()
+    benchmark(args.size,args.latency,args.blocksize,args.requests,args.window,args.packet,args.prefetch,verbose=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# Copyright (C) 2022-2026  Hsin Yuan Yeh <iapyeh@gmail.com>
+#
+# This file is part of Sshscript.
+#
+# SSHScript is free software; you can redistribute it and/or modify it under the
+# terms of the MIT License.
+#
+# SSHScript is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the MIT License for more details.
+#
+# You should have received a copy of the MIT License along with SSHScript;
+# if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+'''
+On-disk cache of converted .spy scripts (v2.0.3)
+
+Like __pycache__ of Python, the converted python script of a .spy file and
+its compiled code object are saved into the "__pycache__" folder next to the
+.spy file. Then, SSHScriptSession.run() can skip both sshscriptparser.convert()
+and compile() when the content of the .spy file (after $.include() was expanded)
+has not been changed.
+
+    <folder>/__pycache__/<name>.spy.sshscript-<version>.spyc
+
+The cache file is a marshalled tuple of (digest, pyscript, code).
+The digest is the sha256 of the sshscript's version, the python's magic number
+and the content of the script. So, a cache file would be ignored when
+either one of them has been changed.
+
+Environment variables:
+    SSHSCRIPT_CACHE=0         : disable the cache (also by "sshscript --no-cache")
+    SSHSCRIPT_CACHE_DIR=path  : save cache files in this folder instead of __pycache__
+'''
+import os
+import sys
+import marshal
+import hashlib
+import importlib.util
+try:
+    from . import __version__
+except ImportError:
+    ## called directly from the same folder
+    __version__ = 'unknown'
+try:
+    from .sshscripterror import logDebug, logDebug8
+except ImportError:
+    from sshscripterror import logDebug, logDebug8
+
+def enabled():
+    return os.environ.get('SSHSCRIPT_CACHE','1') not in ('0','','no','false')
+
+def cacheable(scriptPath):
+    ## only .spy file would be cached, scripts given by session.run(), session.onedollar() are not cached.
+    if not (scriptPath and enabled()): return False
+    return os.path.splitext(scriptPath)[1] == os.environ.get('SSHSCRIPT_EXT','.spy')
+
+def digestOf(spyscript):
+    h = hashlib.sha256()
+    h.update(f'sshscript-{__version__}'.encode('utf8'))
+    h.update(importlib.util.MAGIC_NUMBER)
+    h.update(spyscript.encode('utf8','replace'))
+    return h.hexdigest()
+
+def cachePath(scriptPath):
+    basename = f'{os.path.basename(scriptPath)}.sshscript-{__version__}.spyc'
+    cacheDir = os.environ.get('SSHSCRIPT_CACHE_DIR')
+    if cacheDir:
+        ## prevent from conflicting of files with the same name in different folders
+        folderDigest = hashlib.sha256(os.path.dirname(os.path.abspath(scriptPath)).encode('utf8','replace')).hexdigest()[:16]
+        return os.path.join(cacheDir,folderDigest,basename)
+    else:
+        return os.path.join(os.path.dirname(os.path.abspath(scriptPath)),'__pycache__',basename)
+
+def load(scriptPath,digest):
+    ## returns (pyscript, code) or None if cache missed
+    path = cachePath(scriptPath)
+    try:
+        with open(path,'rb') as fd:
+            cachedDigest, pyscript, code = marshal.load(fd)
+    except FileNotFoundError:
+        logDebug8(f'[cache] no cache for {scriptPath}')
+        return None
+    except Exception as e:
+        ## corrupted or generated by an incompatible python
+        logDebug(f'[cache] failed to load {path}, reason: {e}')
+        return None
+    if cachedDigest != digest:
+        logDebug8(f'[cache] {path} is stale')
+        return None
+    logDebug8(f'[cache] hit {path}')
+    return (pyscript, code)
+
+def save(scriptPath,digest,pyscript,code):
+    ## respect "python -B" and PYTHONDONTWRITEBYTECODE
+    if sys.dont_write_bytecode: return
+    path = cachePath(scriptPath)
+    tmppath = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        with open(tmppath,'wb') as fd:
+            marshal.dump((digest,pyscript,code),fd)
+        ## atomic, other sshscript processes would not read a partially-written file
+        os.replace(tmppath,path)
+    except OSError as e:
+        ## eg. read-only folder, just run without cache
+        logDebug(f'[cache] failed to save {path}, reason: {e}')
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+    else:
+        logDebug8(f'[cache] saved {path}')
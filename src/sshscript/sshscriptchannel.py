@@ -19,16 +19,17 @@ import paramiko
 from logging import DEBUG
 import time
 import subprocess
-from select import select
 import errno
 import traceback
-#import asyncio
+import asyncio
 try:
     from .sshscripterror import  logDebug, logDebug8
-    from .sshscriptchannelutils import Prompt, InnerConsoleSu, InnerConsoleSudo,GenericConsole,EnterConsole ,IterableEnterConsole,InnerConsoleWithDollar
+    from .sshscriptchannelutils import Prompt, InnerConsoleSu, InnerConsoleSudo,GenericConsole,EnterConsole ,IterableEnterConsole,InnerConsoleWithDollar,OutputBuffer,LineAssembler
+    from .sshscriptreactor import getReactor
 except ImportError:
     from sshscripterror import  logDebug, logDebug8
-    from sshscriptchannelutils import Prompt, InnerConsoleSu, InnerConsoleSudo,GenericConsole,EnterConsole,IterableEnterConsole,InnerConsoleWithDollar
+    from sshscriptchannelutils import Prompt, InnerConsoleSu, InnerConsoleSudo,GenericConsole,EnterConsole,IterableEnterConsole,InnerConsoleWithDollar,OutputBuffer,LineAssembler
+    from sshscriptreactor import getReactor
 
 ##https://stackoverflow.com/questions/34504970/non-blocking-read-on-os-pipe-on-windows
 if sys.platform == 'win32':
@@ -85,10 +86,10 @@ class WithChannelWrapper(GenericConsole):
 
     @property
     def stdout(self):
-        return self.channel._exitcodePatternForClean.sub(r'\1',self.channel.stdout)
+        return self.channel.cleanedStdout
     @property
     def stderr(self):
-        return self.channel._exitcodePatternForClean.sub(r'\1',self.channel.stderr)
+        return self.channel.cleanedStderr
     @property
     def rawstdout(self):
         return self.channel.rawstdoutForOwner()
@@ -106,9 +107,19 @@ class WithChannelWrapper(GenericConsole):
     def input(self,s):
         return self.channel.send(s+'\n')
 
-    def sendline(self,s,timeout=None,stderr=None,stdout=None,prompt=None):
+    ## v2.0.3
+    @property
+    def framing(self):
+        return self.channel.defaultFraming
+    @framing.setter
+    def framing(self,yes):
+        self.channel.defaultFraming = True if yes else False
+
+    def sendline(self,s,timeout=None,stderr=None,stdout=None,prompt=None,framing=None):
         ## prompt:bool,  enable "prompt-method" to recognize the end of a command execution
         ##        if this is False and prompt is not been figuring out, use "timeout"
+        ## framing:bool, (v2.0.3) recognize the end of a command by a marker carrying its exitcode,
+        ##        if None, using console.framing (default to os.environ['SSHSCRIPT_FRAMING'])
         ## timeout:int,  wait output untill timeout seconds, default to OUTPUT_TIMEOUT and 
         ##         SSH_OUTPUT_TIMEOUT ,  it is 0.5seconds (previous CMD_INTERVAL, SSH_OUTPUT_TIMEOUT).
         ##         If timeout is 0, prompt is automatically False. which means waiting infinitely.
@@ -130,7 +141,7 @@ class WithChannelWrapper(GenericConsole):
             outputType = 2
         else:
             outputType = 0
-        return self.channel.sendline(s,outputTimeout=timeout,outputType=outputType,waitPrompt=prompt)
+        return self.channel.sendline(s,outputTimeout=timeout,outputType=outputType,waitPrompt=prompt,framing=framing)
     ## alias for sendline
     __call__ = sendline
     exec_command = sendline
@@ -226,21 +237,22 @@ class GenericChannel(object):
     #self.terminalControlCodePattern = re.compile(r'(\x1b\[|\x9b)[^@-_]*[@-_]|\x1b[@-_]',re.I)
     ## fish returns more complex control codes than other shells( "\n" \x0a is excluded from the following pattern)
     terminalControlCodePattern = re.compile(r'(\x1b\[|\x9b)[^@-_]*[@-_]|\x1b[@-_]|[\x00-\x09]|[\x0b\x0f]',re.I)
+    ## v2.0.3, compiled once for all channels instead of in every __init__()
+    ## note: the searching text might contain terminal control characters
+    ## REF: https://regex101.com/
+    _exitcodePatternForClean = re.compile('(\W?)(?:echo )?__exitcode\d\-\-.+?\-\-\\r?\\n?',re.S)
+    ## rotate the command to ask for exitcode, this is for preventing from falsely got previous exitcode
+    _exitcodeSnoTotal = 10
+    _exitcodePatternOfCode = [re.compile(f'__exitcode{i}--(\d+)--(\\r?)$',re.M|re.A) for i in range(_exitcodeSnoTotal)]
     
     def __init__(self,owner):
         ## timeout of every call to "sendline" to execute commands
-        self.allStdoutBuf = []
-        self.allStderrBuf = [] 
         ## True when addStdoutData or addStderrData were called.
-        ## False when updateStdoutStderr was called (self.stdoutBuf => self._stdout, self.stderrBuf => self._stderr)
+        ## False when updateStdoutStderr was called (self.stdoutOutput => self._stdout, self.stderrOutput => self._stderr)
         self._stdoutTainted = False
         self._stderrTainted = False
-        self._stdout = ''
-        self._stderr = ''    
         self._exitcode = -1    
-        self.stdoutBuf = []
-        self.stderrBuf = []
-        ## Guarding self._stdout, self._stderr, self.stdoutBuf, self.stderrBuf
+        ## Guarding self._stdout, self._stderr, self.stdoutOutput, self.stderrOutput
         self._lock = threading.Lock()
         self._lockReason = False
         ## an instance of SSHScriptDollar
@@ -250,9 +262,12 @@ class GenericChannel(object):
         self.owner._stderr = self.stderrForOwner
         self.owner._rawstdout = self.rawstdoutForOwner
         self.owner._rawstderr = self.rawstderrForOwner
+        self.owner._openstdout = self.openStdoutForOwner
+        self.owner._openstderr = self.openStderrForOwner
         self.shellToRun = self.owner.shellToRun
-        self.stdoutDumpBuf = []
-        self.stderrDumpBuf = []
+        ## v2.0.3, partial lines for listeners and dump2sys
+        self.stdoutDumpBuf = LineAssembler()
+        self.stderrDumpBuf = LineAssembler()
         if os.environ.get('VERBOSE'):
             ## verbose-related
             self.dump2sys = True
@@ -276,24 +291,33 @@ class GenericChannel(object):
         
         self._prompt = None
         self.defaultUsingPrompt = False
+        ## v2.0.3, see sendFramed()
+        self.defaultFraming = os.environ.get('SSHSCRIPT_FRAMING','') not in ('','0')
         ## mostly is $? for bash, sh, zsh, but it is "$status" for fish
         self._exitcodeSymbol = ('\\echo','$?')
         self._promptstacks = []
         
 
         self._checkExitcodeForSendline = True
-        ## note: the searching text might contain terminal control characters
-        ## REF: https://regex101.com/
-        self._exitcodePatternOfCode = []
-        self._exitcodePatternForClean = re.compile('(\W?)(?:echo )?__exitcode\d\-\-.+?\-\-\\r?\\n?',re.S)
-        ## rotate the command to ask for exitcode, this is for preventing from falsely got previous exitcode
+        ## v2.0.3, outputs are stored once, console.stdout of the current command
+        ## and $.stdout of all commands are views of them.
+        ## outputs over SSHSCRIPT_SPILL_SIZE bytes (default to 128MB, 0 to disable) are moved to temporary files
+        spillSize = int(os.environ.get('SSHSCRIPT_SPILL_SIZE',128*1024*1024))
+        self.stdoutOutput = OutputBuffer(self._exitcodePatternForClean,spillSize)
+        self.stderrOutput = OutputBuffer(self._exitcodePatternForClean,spillSize)
+        ## (length of stderr, $.stderr)
+        self._stderrForOwnerCache = (0,'')
         self._exitcodeSno = 0
-        self._exitcodeSnoTotal = 10
-        for i in range(self._exitcodeSnoTotal):
-            self._exitcodePatternOfCode.append(re.compile(f'__exitcode{i}--(\d+)--(\\r?)$',re.M|re.A))
 
         self._lastIOTime = time.time()
         self._lastIOType = 0
+        ## v2.0.3, notified by touchIO(), for expect() and wait() without polling
+        self._dataCondition = threading.Condition()
+        self._dataSerial = 0
+        ## v2.0.3, [(event loop, future), ...] of aexpect() waiting for data
+        self._asyncWaiters = []
+        ## v2.0.3, how many searched characters are searched again with newly received data in expect()
+        self.expectWindow = int(os.environ.get('SSHSCRIPT_EXPECT_WINDOW',4096))
 
         self.exitListener = None
 
@@ -347,8 +371,24 @@ class GenericChannel(object):
         return searchPrompt()
 
     def touchIO(self,type):
-        self._lastIOType = type
-        self._lastIOTime = time.time()
+        ## v2.0.3, called after data was added to buffers, wakes up expect() and wait()
+        with self._dataCondition:
+            self._lastIOType = type
+            self._lastIOTime = time.time()
+            self._dataSerial += 1
+            self._dataCondition.notify_all()
+            waiters, self._asyncWaiters = self._asyncWaiters, []
+        ## v2.0.3, wake up aexpect() in event loops
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(self._wakeAsyncWaiter,future)
+            except RuntimeError:
+                ## the event loop was closed
+                pass
+
+    @staticmethod
+    def _wakeAsyncWaiter(future):
+        if not future.done(): future.set_result(None)
 
     ## v2.0 refined routines
     def wait(self,waitingInterval,timeout=0,mustHasOutput=False):
@@ -364,25 +404,29 @@ class GenericChannel(object):
                that would lead to timeout sice there was already output before calling this function.
         """
         start = time.time()
+        ## v2.0.3, no more polling. Sleep until the moment of idle for <waitingInterval> seconds,
+        ## if there was io activity in the meantime, sleep again until the postponed moment.
+        ## like before, block at least 0.1 seconds for outputs of the command just sent.
+        earliest = start + 0.1
         if mustHasOutput:
             lastT = mustHasOutput if isinstance(mustHasOutput,float) else self._lastIOTime
             endtime = (start + 10)
+            with self._dataCondition:
+                while self._lastIOTime == lastT:
+                    now = time.time()
+                    if now >= endtime: raise TimeoutError(f'wait exceeded 10 seconds has no output(from:{start} to:{now}, last IO at:{lastT})')
+                    ## notified by touchIO()
+                    self._dataCondition.wait(endtime - now)
+            ## recount endtime
+            endtime = (time.time() + timeout) if (timeout > 0) else 0
         else:
             endtime = (start + timeout) if (timeout > 0) else 0
         while True:
-            time.sleep(0.1)
             now = time.time()
-            if mustHasOutput:
-                if self._lastIOTime == lastT:
-                    if now < endtime: continue
-                    else: raise TimeoutError(f'wait exceeded 10 seconds has no output(from:{start} to:{now}, last IO at:{lastT})')
-                else:
-                    ## recount endtime
-                    endtime = (now + timeout) if (timeout > 0) else 0
-                    ## don't enter this block again
-                    mustHasOutput = False
-            if waitingInterval <= now - self._lastIOTime: break
-            elif endtime and now > endtime: raise TimeoutError(f'wait exceeded {timeout}')
+            deadline = max(earliest, self._lastIOTime + waitingInterval)
+            if now >= deadline: break
+            elif endtime and now >= endtime: raise TimeoutError(f'wait exceeded {timeout}')
+            time.sleep((min(deadline,endtime) if endtime else deadline) - now)
                 
         ## help outputs on screen in order (to do:why here?)
         sys.stdout.flush()
@@ -396,6 +440,14 @@ class GenericChannel(object):
         sys.stdout.flush()
         sys.stderr.flush()
 
+    ## v2.0.3, texts of the current command, received until the last call to updateStdoutStderr()
+    @property
+    def _stdout(self):
+        return self.stdoutOutput.text(whole=False)
+    @property
+    def _stderr(self):
+        return self.stderrOutput.text(whole=False)
+
     @property
     def stdout(self):
         self.updateStdoutStderr('.stdout')
@@ -409,6 +461,27 @@ class GenericChannel(object):
     def exitcode(self):
         return self._exitcode
 
+    ## v2.0.3, console.stdout and console.stderr without __exitcode markers
+    @property
+    def cleanedStdout(self):
+        self.lock(1,'.cleanedStdout')
+        try:
+            self.stdoutOutput.update()
+            return self.stdoutOutput.cleaned(whole=False)
+        finally:
+            self.lock(0)
+    @property
+    def cleanedStderr(self):
+        self.lock(1,'.cleanedStderr')
+        try:
+            self.stderrOutput.update()
+            return self.stderrOutput.cleaned(whole=False)
+        finally:
+            self.lock(0)
+
+    def _cleanExitcode(self,text):
+        return self._exitcodePatternForClean.sub(r'\1',text)
+
     def trim(self,text):
         ## 1 Finds all ASCII control codes and cursor positioning codes in text.
         ## 2 Remove "__exitcode__" in output
@@ -457,35 +530,37 @@ class GenericChannel(object):
     '''
 
     def _resetBufferAll(self):
-        del self.allStderrBuf[:]
-        del self.allStdoutBuf[:]
+        self.lock(1,'_resetBufferAll()')
+        self.stdoutOutput.clear()
+        self.stderrOutput.clear()
+        self._stderrForOwnerCache = (0,'')
+        self.lock(0)
         self._resetBuffer()
 
     def _resetBuffer(self):
         ## clean up console.stdout, console.stderr
         ## dump to screen for verbose mode, then clean up its buffers
         self.lock(1,'_resetBuffer()')
-        del self.stdoutBuf[:]
-        del self.stderrBuf[:]
-        self._stdout = ''
-        self._stderr = ''
+        ## v2.0.3, outputs of the next command start from here
+        self.stdoutOutput.mark()
+        self.stderrOutput.mark()
         self._exitcode = -1
         self._prompt.position = 0
         newline = os.linesep.encode('utf8')
         if len(self.stdoutDumpBuf):
+            data = self.stdoutDumpBuf.flush()
             if self.stdoutListener:
-                self.stdoutListener(1,[b''.join(self.stdoutDumpBuf)])
+                self.stdoutListener(1,[data])
             if self.dump2sys:
-                sys.stdout.buffer.write(self.stdoutPrefix + b''.join(self.stdoutDumpBuf) + newline)
+                sys.stdout.buffer.write(self.stdoutPrefix + data + newline)
                 sys.stdout.buffer.flush()
-            del self.stdoutDumpBuf[:]    
         if len(self.stderrDumpBuf):
+            data = self.stderrDumpBuf.flush()
             if self.stderrListener:
-                self.stderrListener(2,[b''.join(self.stderrDumpBuf)])
+                self.stderrListener(2,[data])
             if self.dump2sys:
-                sys.stderr.buffer.write(self.stderrPrefix + b''.join(self.stderrDumpBuf) + newline)
-                sys.stderr.buffer.flush()        
-            del self.stderrDumpBuf[:]
+                sys.stderr.buffer.write(self.stderrPrefix + data + newline)
+                sys.stderr.buffer.flush()
         self.lock(0)
     def lock(self, yes, reason=None):
         if yes:
@@ -501,36 +576,75 @@ class GenericChannel(object):
         try:
             ## ensure not to do this while receiving data
             self.lock(1, f'updateStdoutStderr({"" if caller is None else caller})')
+            ## v2.0.3, only decode data received after the last call
+            ## the text is made when self._stdout or self._stderr is accessed
             if self._stdoutTainted:
-                self._stdout =  b''.join(self.stdoutBuf).decode('utf8',errors='replace')
+                self.stdoutOutput.update()
                 self._stdoutTainted = False
             if self._stderrTainted:
-                self._rawstderr = b''.join(self.stderrBuf)
-                self._stderr = (b''.join(self.stderrBuf)).decode('utf8',errors='replace')
+                self.stderrOutput.update()
                 self._stderrTainted = False
         finally:
             self.lock(0)
 
     def stdoutForOwner(self):
         ## because we no more setup prompt, to strip out prompt is not necessary
-        return self._exitcodePatternForClean.sub(r'\1', ((b''.join(self.allStdoutBuf)).decode('utf8','replace')))
+        ## v2.0.3, only data received after the last call is decoded and searched for markers
+        self.lock(1,'stdoutForOwner()')
+        try:
+            self.stdoutOutput.update()
+            return self.stdoutOutput.cleaned()
+        finally:
+            self.lock(0)
 
     def stderrForOwner(self):
         ## because we no more setup prompt, to strip out prompt is not necessary
-        return (self._exitcodePatternForClean.sub(r'\1',self.trim((b''.join(self.allStderrBuf)).decode('utf8','replace'))))
+        self.lock(1,'stderrForOwner()')
+        try:
+            self.stderrOutput.update()
+            ## stderr is usually small, the trimmed value is cached until more data comes
+            if self._stderrForOwnerCache[0] != len(self.stderrOutput):
+                self._stderrForOwnerCache = (len(self.stderrOutput),self._cleanExitcode(self.trim(self.stderrOutput.text())))
+            return self._stderrForOwnerCache[1]
+        finally:
+            self.lock(0)
     def rawstdoutForOwner(self):
         ## because we no more setup prompt, to strip out prompt is not necessary
-        return (b''.join(self.allStdoutBuf))
+        ## v2.0.3, it is a read-only mmap.mmap if the output was spilled to a temporary file
+        self.lock(1,'rawstdoutForOwner()')
+        try:
+            return self.stdoutOutput.raw()
+        finally:
+            self.lock(0)
     def rawstderrForOwner(self):
         ## because we no more setup prompt, to strip out prompt is not necessary
-        return (b''.join(self.allStderrBuf))
+        self.lock(1,'rawstderrForOwner()')
+        try:
+            return self.stderrOutput.raw()
+        finally:
+            self.lock(0)
+    ## v2.0.3
+    def openStdoutForOwner(self,text=False):
+        self.lock(1,'openStdoutForOwner()')
+        try:
+            return self.stdoutOutput.open(text=text)
+        finally:
+            self.lock(0)
+    def openStderrForOwner(self,text=False):
+        self.lock(1,'openStderrForOwner()')
+        try:
+            return self.stderrOutput.open(text=text)
+        finally:
+            self.lock(0)
 
     def trimedStdoutForOwner(self):
         ## because we no more setup prompt, to strip out prompt is not necessary
-        return self.trim((b''.join(self.allStdoutBuf)).decode('utf8','replace'))
+        self.stdoutOutput.update()
+        return self.trim(self.stdoutOutput.text())
     def trimedStderrForOwner(self):
         ## because we no more setup prompt, to strip out prompt is not necessary
-        return self.trim((b''.join(self.allStderrBuf)).decode('utf8','replace'))
+        self.stderrOutput.update()
+        return self.trim(self.stderrOutput.text())
 
     ## v2.0, expectTimeout is renamed to timeout
     ## v2.0, if given rawpat is string or bytes, then it was escaped automatically
@@ -544,79 +658,124 @@ class GenericChannel(object):
         :timeout:  0: waiting forever
                    None: self.commandTimeout, aka os.environ['CMD_TIMEOUT' or 'SSH_CMD_TIMEOUT'] (default)
         """
+        steps = self._expecting(rawpat,timeout,stdout,stderr,position,silent)
+        try:
+            serial, seconds = next(steps)
+            while True:
+                with self._dataCondition:
+                    if serial == self._dataSerial:
+                        self._dataCondition.wait(seconds)
+                serial, seconds = next(steps)
+        except StopIteration as e:
+            return e.value
+
+    async def aexpect(self,rawpat,timeout=None,stdout=True,stderr=True,position=0,silent=False):
+        ## v2.0.3, expect() for asyncio, it waits for data in the event loop, not in a thread
+        loop = asyncio.get_running_loop()
+        steps = self._expecting(rawpat,timeout,stdout,stderr,position,silent)
+        try:
+            serial, seconds = next(steps)
+            while True:
+                future = loop.create_future()
+                with self._dataCondition:
+                    if serial == self._dataSerial:
+                        self._asyncWaiters.append((loop,future))
+                    else:
+                        future.set_result(None)
+                try:
+                    await asyncio.wait_for(future,seconds)
+                except asyncio.TimeoutError:
+                    pass
+                serial, seconds = next(steps)
+        except StopIteration as e:
+            return e.value
+
+    def _expecting(self,rawpat,timeout,stdout,stderr,position,silent):
+        ## v2.0.3, the matching loop of expect() and aexpect(). It yields (serial, seconds) when
+        ## nothing was found, then the caller should wait up to seconds for data newer than serial.
+        ## The match (or None) is returned by StopIteration.
         assert isinstance(position,int)
         
         if timeout is None: timeout = self.commandTimeout
         
-        def checkStdout():
-            return self._stdout + (b''.join(self.stdoutBuf)).decode('utf8','replace')
-        def checkStderr():
-            return self._stderr + (b''.join(self.stderrBuf)).decode('utf8','replace')            
-
-        targets = []
-        if stdout:
-            targets.append(checkStdout)
-        if stderr:
-            targets.append(checkStderr)
-        
-        pats = []
+        ## v2.0.3, streaming matcher.
+        ## str and bytes are combined into one alternation, re.Pattern are searched one by one.
+        ## When data comes, only the newly received text (plus an overlapping window of
+        ## the searched text, for matches across the chunks) is searched.
+        ## If multiple patterns matched, the one starts earliest wins, then the first one in rawpat.
         if not (isinstance(rawpat,list) or isinstance(rawpat,tuple)):
             rawpat = [rawpat]
+        pats = []
+        literals = []
         for pat in rawpat:
             if isinstance(pat,bytes):
-                pat = re.compile(re.escape(pat.decode('utf8','replace')),re.I)
-            elif isinstance(pat,str):
+                pat = pat.decode('utf8','replace')
+            if isinstance(pat,str):
+                literals.append((len(pats),pat))
                 pat = re.compile(re.escape(pat),re.I)
             elif isinstance(pat,re.Pattern):
                 pass
             else:
                 raise ValueError('expect() only accept bytes,str,re.Pattern or list of them')
             pats.append(pat)
-        
-        ret = None
+        ## (index of pats or None for the combined, compiled pattern)
+        literalIdx = set(x[0] for x in literals)
+        searchers = [(idx,pat) for idx,pat in enumerate(pats) if idx not in literalIdx]
+        if len(literals) > 1:
+            searchers.append((None,re.compile('|'.join(f'({re.escape(x[1])})' for x in literals),re.I)))
+        elif literals:
+            searchers.append((literals[0][0],pats[literals[0][0]]))
+        overlap = max([self.expectWindow] + [len(x[1]) for x in literals])
+
+        def search(text,scanFrom):
+            ## returns (start in text, index of pats) of the earliest match or None
+            found = None
+            for idx,pat in searchers:
+                m = pat.search(text,scanFrom)
+                if m is None: continue
+                if idx is None:
+                    idx = literals[m.lastindex-1][0]
+                if found is None or (m.start(),idx) < found:
+                    found = (m.start(),idx)
+            return found
+
+        ## [OutputBuffer, offset in the text of the current command to search from]
+        targets = []
+        if stdout:
+            targets.append([self.stdoutOutput, position])
+        if stderr:
+            targets.append([self.stderrOutput, position])
+
         endTime = (time.time() + timeout) if timeout else 0
-        searchedText = []
         while True:
-            if endTime > 0 and time.time() > endTime:
-                if silent:
-                    pass
-                else:
-                    ## outputs for debugging before TimeoutError was raised
-                    self.log8(f'expect() position={[position]}')
-                    for text in searchedText:
-                        self.log8(f'expect() searched={[text]}')
-                    ret = TimeoutError(f'Not found: {rawpat}')
-                break
+            with self._dataCondition:
+                serial = self._dataSerial
             self.updateStdoutStderr('expect() watching')
-            del searchedText[:]
-            for dataSource in targets:
-                text = dataSource()
-                if text == '': 
-                    searchedText.append(('',''))
-                    continue
-                for idx,pat in enumerate(pats):
-                    searchedText.append((text,text[position:]))
-                    m = pat.search(text[position:])
-                    if m:
-                        ## 2023/8/14, since we now called updateStdoutStderr() when it was accessed by self.stdout or self.stderr
-                        ## this might not be necessary anymore
-                        ## call updateStdoutStderr() again to ensure all data is updated to _stdout
-                        ## 2023/10/8, To do: do we really need to call updateStdoutStderr() here?
-                        self.updateStdoutStderr('expect() watching end')
-                        ## v2.0, re.pattern returned
-                        ret = m
-                        break
-                if ret is not None: break
-            if ret is not None: break
-            time.sleep(0.05)
-        if isinstance(ret, TimeoutError):
-            raise ret
-        else:
-            ## 2023/8/14, since in the sendline, updateStdoutStderr() is no more been called,
-            ## this block might not be necessary anymore
-            ## 2023/10/8, To do: do we really need to call updateStdoutStderr() here?
-            self.updateStdoutStderr('expect() watching end')
-            return ret
+            for target in targets:
+                output, scanFrom = target
+                length = output.textLength(whole=False)
+                ## buffers were reset
+                if scanFrom > length: scanFrom = position
+                ## only the tail is searched. The first scan searches text[position:] from its beginning,
+                ## as before v2.0.3 (so, "^" and "\A" match at position). Later scans keep one character
+                ## before scanFrom, so "^", "\b" and lookbehinds see what precedes it.
+                base = scanFrom if scanFrom == position else scanFrom - 1
+                found = search(output.tail(base,whole=False),scanFrom - base)
+                if found:
+                    ## the returned match is relative to text[position:] as always
+                    start, idx = found
+                    return pats[idx].search(output.tail(position,whole=False),base + start - position)
+                target[1] = max(position,length - overlap)
+            now = time.time()
+            if endTime > 0 and now > endTime:
+                if silent: return None
+                ## outputs for debugging before TimeoutError was raised
+                self.log8(f'expect() position={[position]}')
+                for target in targets:
+                    self.log8(f'expect() searched={[target[0].tail(position,whole=False)]}')
+                raise TimeoutError(f'Not found: {rawpat}')
+            ## wait for addStdoutData() or addStderrData()
+            yield serial, ((endTime - now) if endTime > 0 else None)
 
     def __enter__(self):
         self.withChannelWrapper =  WithChannelWrapper(self)
@@ -684,8 +843,24 @@ class GenericChannel(object):
         else:
             self._exitcode = int(m.group(1))
         self._exitcodeSno = (self._exitcodeSno + 1) % self._exitcodeSnoTotal
-    def sendline(self,line,outputTimeout=None,outputType=None,waitPrompt=None):
+    ## v2.0.3
+    def sendFramed(self,line,position=0):
+        ## Send the command followed by a marker which carries its exitcode, then block until
+        ## the marker has been received. Neither waiting for the output to stop, nor asking for the exitcode again.
+        ## position: where to search the marker in console.stdout, returns the position after the marker
+        sno = self._exitcodeSno
+        self._exitcodeSno = (self._exitcodeSno + 1) % self._exitcodeSnoTotal
+        self.send(f'{line}\n{self._exitcodeSymbol[0]} __exitcode{sno}--{self._exitcodeSymbol[1]}--\n')
+        m = self.expect(self._exitcodePatternOfCode[sno],timeout=self.commandTimeout,stdout=True,stderr=False,position=position)
+        self._exitcode = int(m.group(1))
+        return position + m.end()
+
+    def sendline(self,line,outputTimeout=None,outputType=None,waitPrompt=None,framing=None):
         ## line: commands to run, accept multiple lines from v1.1.13
+        ## framing: (v2.0.3) if True, using sendFramed() to run every line. 
+        ##             if None, using self.defaultFraming
+        ##             It is not applicable when outputTimeout == 0, waitPrompt is True, 
+        ##             or exitcode is not checked (eg. in $.enter('python3'))
         ## waitPrompt: if False, not expect(self.prompt) after command was sent.
         ##             this is for 'interactive-command' such as 'python'
         ##             if None, using self.daultUsingPrompt
@@ -746,6 +921,19 @@ class GenericChannel(object):
         ## But updateStdoutStderr() was called after the last line (so, it does not cleanup buffers)
         self._resetBuffer()
 
+        if framing is None: framing = self.defaultFraming
+        if framing and outputTimeout != 0 and not waitPrompt and self._checkExitcodeForSendline:
+            position = 0
+            try:
+                for line in lines:
+                    position = self.sendFramed(line,position)
+            finally:
+                ## TimeoutError would be raised if the marker was not received in self.commandTimeout
+                self.sendlineLock.release()
+            error = self.owner.checkExitcode(self.exitcode,self.stderr)
+            if error: raise error
+            return self.stdout, self.stderr, self.exitcode
+
         ## for powershell, send \n would get \n back; send \r\n would get \r\n back
         newline = '\n'
         for idx,line in enumerate(lines):
@@ -787,7 +975,6 @@ class GenericChannel(object):
     def addStdoutData(self,newbytes):  
         ## x: bytes
         if not newbytes:return
-        self.touchIO(1)
         lines = None
         bNewline = b'\n'
         self.lock(1,f'addStdoutData({self._keepStdoutValue})')
@@ -795,26 +982,18 @@ class GenericChannel(object):
         ## self._keepStdoutValue would be false when there is a inifite loop
         ## which is requesting its stdout's value  by "for line in console.stdout(0)"
         if self._keepStdoutValue:
-            self.stdoutBuf.append(newbytes)
-            self.allStdoutBuf.append(newbytes)
+            self.stdoutOutput.append(newbytes)
         
         ## split stdoutDumpBuf's data into lines
         ## and extract them out of the stdoutDumpBuf
-        try:
-            p = newbytes.rindex(bNewline)
-        except ValueError:
-            self.stdoutDumpBuf.append(newbytes)
-        else:
-            lines = (b''.join(self.stdoutDumpBuf)+newbytes[:p]).split(bNewline)
-            #del self.stdoutDumpBuf[:]
-            #if p < len(newbytes) - 1:
-            #    self.stdoutDumpBuf.append(newbytes[p+1:])
-            if p < len(newbytes) - 1:
-                del self.stdoutDumpBuf[:p+1]
-            else:
-                del self.stdoutDumpBuf[:]
+        ## v2.0.3, the bytes after the last newline are kept for the next time
+        ## only when someone would consume lines (listener set by console.iterate() or in verbose mode)
+        if self.stdoutListener or self.dump2sys:
+            lines = self.stdoutDumpBuf.feed(newbytes)
         self._stdoutTainted = True
         self.lock(0)
+        ## v2.0.3, touch after data was added, so who was woken up can see the data
+        self.touchIO(1)
         if lines is not None:
             if self.stdoutListener:
                 self.stdoutListener(1,[x+bNewline for x in lines])
@@ -824,37 +1003,23 @@ class GenericChannel(object):
 
     def addStderrData(self,newbytes):
         if not newbytes: return
-        self.touchIO(2)
         lines = None
         bNewline = b'\n'
         self.lock(1,f'addStderrData({self._keepStderrValue})')
         ## self._keepStderrValue would be false when there is a inifite loop
         ## which is requesting its stdout's value  by "for line in console.stdout(0)"
         if self._keepStderrValue:
-            self.stderrBuf.append(newbytes)
-            self.allStderrBuf.append(newbytes)
+            self.stderrOutput.append(newbytes)
 
         ## fix bug v1.1.18        
         ## split stderrDumpBuf's data into lines
         ## and extract them out of the stderrDumpBuf
-        try:
-            p = newbytes.rindex(bNewline)
-        except ValueError:
-            self.stderrDumpBuf.append(newbytes)
-        else:
-            lines = (b''.join(self.stderrDumpBuf)+newbytes[:p]).split(bNewline)
-            #del self.stderrDumpBuf[:]
-            #if p < len(newbytes) - 1:
-            #    ## leave residual bytes in the stderrDumpBuf
-            #    self.stderrDumpBuf.append(newbytes[p+1:])
-            if p < len(newbytes) - 1:
-                del self.stderrDumpBuf[:p+1]
-            else:
-                del self.stderrDumpBuf[:]
-
-
+        if self.stderrListener or self.dump2sys:
+            lines = self.stderrDumpBuf.feed(newbytes)
         self._stderrTainted = True
         self.lock(0)
+        ## v2.0.3, touch after data was added, so who was woken up can see the data
+        self.touchIO(2)
         if lines is not None:
             if self.stderrListener:
                 self.stderrListener(2,[x+bNewline for x in lines])
@@ -869,14 +1034,14 @@ class GenericChannel(object):
 
         bNewline = b'\n'
         if len(self.stdoutDumpBuf):
-            lines = (b''.join(self.stdoutDumpBuf)).split(bNewline)
+            lines = self.stdoutDumpBuf.flush().split(bNewline)
             if self.stdoutListener:
                 self.stdoutListener(1,[x+bNewline for x in lines])
             if self.dump2sys:
                 sys.stdout.buffer.write(bNewline.join([self.stdoutPrefix + x  for x in lines])+bNewline)
                 sys.stdout.buffer.flush()
         if len(self.stderrDumpBuf):
-            lines = (b''.join(self.stderrDumpBuf)).split(bNewline)
+            lines = self.stderrDumpBuf.flush().split(bNewline)
             if self.stderrListener:
                 self.stderrListener(1,[x+bNewline for x in lines])
             if self.dump2sys:
@@ -927,50 +1092,36 @@ class POpenChannel(GenericChannel):
                 threading.Thread(target=_win32ReadingStdout).start()
                 threading.Thread(target=_win32ReadingStderr).start()
             else:
-                ## read pty
-                def _reading():
-                    buffer = {
-                        self.masterFd[0]: self.addStdoutData,  #stdout
-                        self.masterFd[1]: self.addStderrData  #stderr
-                    }
-                    #if len(self.masterFd) == 2:
-                    #    buffer[self.masterFd[1]]= self.addStderrData
-                    #while (not self.closed) and buffer:
-                    while (self.cp.poll() is None):
-                        try:
-                            ## timeout = 1
-                            for fd in select(buffer, [], [],1)[0]:
-                                try:
-                                    if isinstance(fd,int):
-                                        data = os.read(fd, 512) # read available
-                                    else:
-                                        data = fd.read1()
-                                except OSError as e:
-                                    if e.errno == errno.EIO:
-                                        pass
-                                    elif e.errno == errno.EBADF:
-                                        pass
-                                    else:
-                                        raise #XXX cleanup
-                                    del buffer[fd] # EIO means EOF on some systems
-                                else:
-                                    if not data: # EOF
-                                        del buffer[fd]
-                                    else:
-                                        buffer[fd](data)
-                            time.sleep(0.01)
-                        except OSError as e:
-                            if e.errno == errno.EBADF:
-                                # being closed
-                                break
-                            else:
-                                raise 
-
-                threading.Thread(target=_reading,name='sshscriptchannel-popen-read').start()
+                ## v2.0.3, read pty and pipe in the shared reactor's thread (see sshscriptreactor.py)
+                ## instead of a reading thread for every channel
+                self.readingFds = [self.masterFd[0],self.masterFd[1]]
+                reactor = getReactor()
+                reactor.register(self.masterFd[0],self._readingStdout)
+                reactor.register(self.masterFd[1],self._readingStderr)
                 ## this is not necessary
                 #self.setupSSHScriptPrompt(stderr=True)
         self.sendlineLock.release()
 
+    def _reading(self,fd,addData):
+        ## called by the reactor when fd is readable, returns False on EOF to unregister fd
+        try:
+            if isinstance(fd,int):
+                data = os.read(fd, 512) # read available
+            else:
+                data = fd.read1()
+        except OSError as e:
+            if e.errno in (errno.EIO, errno.EBADF):
+                ## EIO means EOF on some systems
+                return False
+            raise
+        if not data: # EOF
+            return False
+        addData(data)
+    def _readingStdout(self,fd):
+        return self._reading(fd,self.addStdoutData)
+    def _readingStderr(self,fd):
+        return self._reading(fd,self.addStderrData)
+
     @property
     def waitingInterval(self):
         ## wait for io activity to stop
@@ -1024,6 +1175,10 @@ class POpenChannel(GenericChannel):
                 ## that is the exitcode before calling this close() method. (see sshscriptdollar.py)
                 pass
 
+            ## should be unregistered before they were closed
+            for fd in getattr(self,'readingFds',()):
+                getReactor().unregister(fd)
+
             ## help to close the pty
             try:
                 os.close(self.ptyForClose[0])
@@ -1040,37 +1195,42 @@ class ParamikoChannel(GenericChannel):
         super().__init__(owner)
         self.prefixOfLog = "[ParamikoChannel]"
         self._prompt = Prompt(self,None,type=1)
-        def _reading():
-            ## this is run in thread
-            while not (self.channel.closed or self.channel.exit_status_ready()):
-                while self.channel.recv_stderr_ready():
-                    self.addStderrData(self.channel.recv_stderr(4096))
-                while self.channel.recv_ready():
-                    self.addStdoutData(self.channel.recv(4096))     
         ## experimental
         if isinstance(client,paramiko.client.SSHClient):
             ## paramiko's invoke_shell
             self.client = client
             ## a paramiko.Channel
-            self.channel = client._transport.open_session()
-            threading.Thread(target=_reading,name='sshscriptchannel-ssh-read1').start()
-            if self.owner.inWith:
-                ## should enable pty, because without it, interactive python, mysql client won't work.
-                ## but it also produce "prompt" into stdout. that is a problem.
-                self.channel.get_pty()
-            else:
-                ## twodollars, no pty support
-                pass
-            self.channel.set_combine_stderr(False)
-            self.channel.settimeout(self.commandTimeout)
-            baseLastIOTime = self._lastIOTime            
-            if self.owner.usershell:
-                self.channel.exec_command(self.owner.usershell)
-            else:
-                ## default to bash
-                self.owner.usershell = 'bash'
-                self.shellToRun = self.owner.shellToRun = 'bash'
-                self.channel.exec_command('bash')
+            ## v2.0.3, opened by the scheduler, it waits when too many channels are opened on the connection
+            self.scheduler = self.owner.sshscript.scheduler
+            self.channel = self.scheduler.openSession(self.commandTimeout)
+            ## v2.0.3, read in the shared reactor's thread (see sshscriptreactor.py).
+            ## paramiko makes the fileno() readable when either stdout or stderr has data, or when EOF was received.
+            self.readingFd = self.channel.fileno()
+            getReactor().register(self.readingFd,self._reading)
+            try:
+                if self.owner.inWith:
+                    ## should enable pty, because without it, interactive python, mysql client won't work.
+                    ## but it also produce "prompt" into stdout. that is a problem.
+                    self.channel.get_pty()
+                else:
+                    ## twodollars, no pty support
+                    pass
+                self.channel.set_combine_stderr(False)
+                self.channel.settimeout(self.commandTimeout)
+                baseLastIOTime = self._lastIOTime            
+                if self.owner.usershell:
+                    self.channel.exec_command(self.owner.usershell)
+                else:
+                    ## default to bash
+                    self.owner.usershell = 'bash'
+                    self.shellToRun = self.owner.shellToRun = 'bash'
+                    self.channel.exec_command('bash')
+            except:
+                ## v2.0.3, give back the slot of the scheduler and the registration of the reactor
+                getReactor().unregister(self.readingFd)
+                self.channel.close()
+                self.scheduler.release(self.channel)
+                raise
             if self.owner.inWith:
                 ## wait for message of today, prompt of the shell
                 self.wait(0.25,mustHasOutput=baseLastIOTime)
@@ -1098,6 +1258,19 @@ class ParamikoChannel(GenericChannel):
                 pass
         self._resetBufferAll()
         self.sendlineLock.release()
+    def _reading(self,fd):
+        ## called by the reactor when self.channel.fileno() is readable.
+        ## Reads at most one chunk of each stream per call, so a busy channel does not starve others
+        ## on the reactor's thread. fileno() stays readable until the buffers were drained,
+        ## the reactor would call again in its next round.
+        if self.channel.recv_stderr_ready():
+            self.addStderrData(self.channel.recv_stderr(65536))
+        if self.channel.recv_ready():
+            self.addStdoutData(self.channel.recv(65536))
+        ## all received data has been consumed, nothing more would come, returns False to unregister
+        if self.channel.closed or self.channel.eof_received or self.channel.exit_status_ready():
+            if not (self.channel.recv_ready() or self.channel.recv_stderr_ready()): return False
+
     @property
     def waitingInterval(self):
         return self.owner.waitingIntervalSSH
@@ -1144,9 +1317,14 @@ class ParamikoChannel(GenericChannel):
                 if self.channel.exit_status_ready():
                     if self.owner.inWith: self.owner.exitcode = self.channel.recv_exit_status()
                     self.log8(f'[{self.owner.sshscript.host}] smoothly closed, exitcode= {self.owner.exitcode}')
-                self.channel.close()                    
             except paramiko.ssh_exception.SSHException as e:
                 self.log(f'[{self.owner.sshscript.host}] error on closing:{e}')
             except OSError as e:
                 self.log(f'[{self.owner.sshscript.host}] error on closing:{e}')
+            finally:
+                ## always, otherwise the reactor keeps the registration and the scheduler loses a slot.
+                ## should be unregistered before the pipe of fileno() is closed by self.channel.close()
+                getReactor().unregister(self.readingFd)
+                self.channel.close()
+                self.scheduler.release(self.channel)
 
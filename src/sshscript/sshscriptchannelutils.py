@@ -13,8 +13,14 @@
 # if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
 #
+import os
 import re
+import io
 import time
+import mmap
+import bisect
+import codecs
+import tempfile
 try:
     from .sshscripterror import  logDebug, logDebug8
 except ImportError:
@@ -97,6 +103,292 @@ class Prompt(object):
         self._type = value
 
 
+class OutputBuffer(object):
+    """
+    v2.0.3, the output of stdout or stderr of a channel, which is stored only once.
+
+    Received bytes are appended to a bytearray and decoded incrementally into
+    a text by an utf8 decoder (a character split over two chunks is decoded correctly).
+    The output of the current command (console.stdout) and the whole output ($.stdout)
+    are views of the same storage, by the offset where the current command starts (see mark()).
+    The exitcode markers are located once in complete lines, so cleaned views are made
+    by skipping them instead of searching the whole text again.
+
+    When the size is over spillSize, the data is moved to a temporary file, and
+    the following data is written to the file. Then the data is memory-mapped
+    when it is accessed, the decoded text is not kept (it is decoded on request).
+    The caller should hold the channel's lock.
+    """
+    def __init__(self,cleanPattern,spillSize=0):
+        ## cleanPattern: re.Pattern of exitcode markers, its group(1) is kept
+        ## spillSize: 0 to always keep data in memory
+        self.cleanPattern = cleanPattern
+        self.spillSize = spillSize
+        self.file = None
+        self.clear()
+    def clear(self):
+        if self.file is not None:
+            ## mmap objects returned by raw() are still valid after the file was closed
+            self.file.close()
+            self.file = None
+        ## (size, mmap.mmap) of the spilled file
+        self._map = (0,None)
+        ## (size, whole text) decoded from the spilled file
+        self._spilledText = (0,'')
+        ## ((length of text, textStart), text of the current command)
+        self._commandText = (None,'')
+        self.size = 0
+        ## bytes if only one chunk was received (eg. output of one-dollar command), otherwise bytearray
+        self.data = b''
+        self._decoder = codecs.getincrementaldecoder('utf8')(errors='replace')
+        ## number of bytes have been decoded
+        self._decoded = 0
+        self._parts = []
+        ## length of the text at the end of every part in self._parts
+        self._partEnds = []
+        self._textLength = 0
+        ## (length of the text, bytes) where the decoder had no pending bytes, for decoding a tail of spilled data
+        self._checkpoints = ([0],[0])
+        ## characters of the text have been searched for markers, and (start,end) of found markers
+        self._scanned = 0
+        self._spans = []
+        ## the text after self._scanned (the last partial line)
+        self._unscanned = ''
+        ## offsets of the current command in self.data and the text
+        self.start = 0
+        self.textStart = 0
+        self._cleanedCache = {}
+    def __len__(self):
+        return self.size
+    @property
+    def spilled(self):
+        return self.file is not None
+    def append(self,data):
+        self.size += len(data)
+        if self.file is not None:
+            self.file.write(data)
+        elif self.spillSize and self.size > self.spillSize:
+            self.file = tempfile.TemporaryFile(prefix='sshscript-',suffix='.out',dir=os.environ.get('SSHSCRIPT_SPILL_DIR'))
+            self.file.write(self.data)
+            self.file.write(data)
+            self.data = b''
+            del self._parts[:]
+            del self._partEnds[:]
+            logDebug8(f'[output] spilled {self.size} bytes to a temporary file')
+        elif not self.data:
+            ## no copy for the first chunk
+            self.data = bytes(data)
+        else:
+            if isinstance(self.data,bytes):
+                self.data = bytearray(self.data)
+            self.data += data
+    def buffer(self):
+        ## all data, an mmap.mmap if spilled, otherwise bytes or bytearray
+        if self.file is None: return self.data
+        if self._map[0] != self.size:
+            self.file.flush()
+            self._map = (self.size,mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ))
+        return self._map[1]
+    def mark(self):
+        ## the output of the current command starts from here
+        self.update()
+        self.start = self.size
+        self.textStart = self._textLength
+    def update(self):
+        ## decode newly received bytes, returns False if there is nothing new
+        size = self.size
+        if size == self._decoded: return False
+        with memoryview(self.buffer()) as view:
+            text = self._decoder.decode(view[self._decoded:size])
+        self._decoded = size
+        if text:
+            self._textLength += len(text)
+            if self.file is None:
+                self._parts.append(text)
+                self._partEnds.append(self._textLength)
+            elif not self._decoder.getstate()[0]:
+                self._checkpoints[0].append(self._textLength)
+                self._checkpoints[1].append(size)
+            self._scan(text)
+        return True
+    def _scan(self,text):
+        ## search markers in complete lines which have not been searched
+        p = text.rfind('\n')
+        if p == -1:
+            self._unscanned += text
+            return
+        lines = self._unscanned + text[:p+1]
+        for m in self.cleanPattern.finditer(lines):
+            self._spans.append((self._scanned + m.end(1),self._scanned + m.end()))
+        self._scanned += len(lines)
+        self._unscanned = text[p+1:]
+    def raw(self,whole=True):
+        ## if spilled, the whole data is returned as a read-only mmap.mmap (a bytes-like object)
+        data = self.buffer()
+        if whole:
+            return bytes(data) if isinstance(data,bytearray) else data
+        return bytes(data[self.start:])
+    def open(self,whole=True,text=False):
+        ## a file-like object to read the data in a streaming way, nothing is copied in advance
+        reader = io.BufferedReader(BufferReader(self.buffer(),0 if whole else self.start,self.size))
+        return io.TextIOWrapper(reader,encoding='utf8',errors='replace',newline='') if text else reader
+    def text(self,whole=True):
+        ## text of data decoded by update()
+        if self.file is not None:
+            ## decoded on request, and cached until more data was decoded
+            if self._spilledText[0] != self._decoded:
+                with memoryview(self.buffer()) as view:
+                    self._spilledText = (self._decoded,codecs.utf_8_decode(view[:self._decoded],'replace',False)[0])
+            text = self._spilledText[1]
+        else:
+            if len(self._parts) > 1:
+                self._parts[:] = [''.join(self._parts)]
+                self._partEnds[:] = [self._textLength]
+            text = self._parts[0] if self._parts else ''
+        if whole or self.textStart == 0: return text
+        ## text of the current command, cached until more data was decoded
+        key = (self._textLength,self.textStart)
+        if self._commandText[0] != key:
+            self._commandText = (key,text[self.textStart:])
+        return self._commandText[1]
+    def textLength(self,whole=True):
+        return self._textLength - (0 if whole else self.textStart)
+    def tail(self,start,whole=True):
+        ## text(whole)[start:], only the tail is copied or decoded (for expect())
+        if not whole: start += self.textStart
+        if start >= self._textLength: return ''
+        if self.file is None:
+            i = bisect.bisect_right(self._partEnds,start)
+            offset = start - (self._partEnds[i-1] if i else 0)
+            if i == len(self._parts) - 1: return self._parts[i][offset:]
+            return ''.join([self._parts[i][offset:]] + self._parts[i+1:])
+        ## decode from the nearest checkpoint before start
+        chars, offsets = self._checkpoints
+        i = bisect.bisect_right(chars,start) - 1
+        with memoryview(self.buffer()) as view:
+            text = codecs.utf_8_decode(view[offsets[i]:self._decoded],'replace',False)[0]
+        return text[start - chars[i]:self._textLength - chars[i]]
+    def cleaned(self,whole=True):
+        ## the text without exitcode markers
+        key = (self._textLength,self.textStart)
+        cached = self._cleanedCache.get(whole)
+        if cached and cached[0] == key: return cached[1]
+        text = self.text()
+        base = 0 if whole else self.textStart
+        ## ranges of text to keep
+        ranges = []
+        position = base
+        for start,end in self._spans:
+            if end <= base: continue
+            if start > position: ranges.append((position,start))
+            position = end
+        scanned = max(position,self._scanned)
+        if scanned > position: ranges.append((position,scanned))
+        ## the last partial line
+        rest = text[scanned:]
+        cleanedRest = self.cleanPattern.sub(r'\1',rest)
+        if cleanedRest is rest:
+            ## no marker in the last partial line, keep it as a range
+            if ranges and ranges[-1][1] == scanned: ranges[-1] = (ranges[-1][0],len(text))
+            elif rest: ranges.append((scanned,len(text)))
+            cleanedRest = ''
+        if not ranges:
+            value = cleanedRest
+        elif len(ranges) == 1 and not cleanedRest:
+            ## mostly, markers are only at the beginning or the end, only one copy is made
+            a, b = ranges[0]
+            value = text if (a == 0 and b == len(text)) else text[a:b]
+        else:
+            value = ''.join([text[a:b] for a,b in ranges] + [cleanedRest])
+        self._cleanedCache[whole] = (key,value)
+        return value
+
+class BufferReader(io.RawIOBase):
+    ## v2.0.3, a raw, read-only stream over a bytes-like object (eg. mmap.mmap) from start to end
+    def __init__(self,data,start,end):
+        self._data = data
+        self._position = start
+        self._end = end
+    def readable(self):
+        return True
+    def readinto(self,b):
+        n = min(len(b),self._end - self._position)
+        if n <= 0: return 0
+        b[:n] = self._data[self._position:self._position+n]
+        self._position += n
+        return n
+
+class LineAssembler(object):
+    """
+    v2.0.3, assembles received chunks into lines for listeners and the verbose dumper.
+    Only newly received bytes are scanned for newline, the partial line is kept
+    in a bytearray, so memory is bounded by the longest partial line.
+    """
+    def __init__(self):
+        ## bytes when it is a single chunk, bytearray when chunks were appended
+        self._partial = b''
+    def __len__(self):
+        return len(self._partial)
+    def _append(self,data):
+        if not self._partial:
+            self._partial = bytes(data)
+        else:
+            if isinstance(self._partial,bytes):
+                self._partial = bytearray(self._partial)
+            self._partial += data
+    def feed(self,data):
+        ## returns complete lines (without the trailing newline) or None if there is no newline in data
+        if data.find(b'\n') == -1:
+            self._append(data)
+            return None
+        lines = data.split(b'\n')
+        rest = lines.pop()
+        if self._partial:
+            self._append(lines[0])
+            lines[0] = bytes(self._partial)
+        self._partial = rest
+        return lines
+    def flush(self):
+        ## returns the partial line and clears it
+        data = bytes(self._partial)
+        self._partial = b''
+        return data
+
+class DelimiterSplitter(object):
+    """
+    v2.0.3, removes delimiters "<token><index>--<exitcode>--\n" from an output stream.
+    They are printed after every line of a batched one-dollar (see SSHScriptDollar.execBatchBySSH).
+    Other data is passed to the callback, and the size of passed data when a delimiter
+    was found is recorded, so the output of every line can be located.
+    Only a tail shorter than a delimiter is held back across chunks.
+    """
+    def __init__(self,token,callback):
+        self.pattern = re.compile(re.escape(token.encode()) + rb'(\d+)--(\d+)--\n')
+        self.holdback = len(token) + 32
+        self.callback = callback
+        self.size = 0
+        ## [(index, exitcode, size of passed data), ...]
+        self.delimiters = []
+        self._pending = b''
+    def _pass(self,data):
+        if data:
+            self.size += len(data)
+            self.callback(data)
+    def feed(self,data):
+        if self._pending: data = self._pending + data
+        pos = 0
+        for m in self.pattern.finditer(data):
+            self._pass(data[pos:m.start()])
+            self.delimiters.append((int(m.group(1)),int(m.group(2)),self.size))
+            pos = m.end()
+        ## a delimiter might be split over two chunks
+        cut = max(pos,len(data) - self.holdback)
+        self._pass(data[pos:cut])
+        self._pending = data[cut:]
+    def flush(self):
+        self._pass(self._pending)
+        self._pending = b''
+
 class GenericConsole(object):
     def __init__(self):
         ## self.returnObjectWhenEnter should be assigned by subclasses
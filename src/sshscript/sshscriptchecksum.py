@@ -0,0 +1,204 @@
+# Copyright (C) 2022-2026  Hsin Yuan Yeh <iapyeh@gmail.com>
+#
+# This file is part of Sshscript.
+#
+# SSHScript is free software; you can redistribute it and/or modify it under the
+# terms of the MIT License.
+#
+# SSHScript is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the MIT License for more details.
+#
+# You should have received a copy of the MIT License along with SSHScript;
+# if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+'''
+Skipping unchanged files of upload() and download() (v2.0.3)
+
+With $.upload(src,dst,skip_unchanged=True) (or download()), the transfer is
+skipped when the destination has the same content. Sizes are compared first,
+then the sha256 of the local file and of the remote file (by "sha256sum" on
+the remote host). After a transfer, the sha256 of the destination is known
+without computing it.
+
+Digests are kept in a persistent cache keyed by host and path, and validated
+by size and mtime. So, repeated runs over thousands of unchanged files cost
+only a stat of both sides for every file. Note that mtime of remote files are
+in seconds, a change of the same size in the same second is not noticed.
+
+    ~/.cache/sshscript/checksums
+
+The cache file is a marshalled dict of "host\\0path" => (size, mtime, sha256),
+host is "" for local files. Paths are absolute (see localPath() and remotePath()),
+so a relative path is not confused with the same name in another folder.
+It is saved when the process exits.
+
+Environment variables:
+    SSHSCRIPT_CHECKSUM_CACHE=path   : the cache file ("0" to keep digests in memory only)
+'''
+import os
+import stat
+import posixpath
+import shlex
+import atexit
+import marshal
+import hashlib
+import threading
+try:
+    from .sshscripterror import logDebug, logDebug8
+    from . import sshscripttransfer
+except ImportError:
+    from sshscripterror import logDebug, logDebug8
+    import sshscripttransfer
+
+def cachePath():
+    path = os.environ.get('SSHSCRIPT_CHECKSUM_CACHE')
+    if path is None:
+        return os.path.join(os.path.expanduser('~'),'.cache','sshscript','checksums')
+    return None if path in ('0','','no','false') else path
+
+class ChecksumCache(object):
+    def __init__(self,path=None):
+        self.path = path
+        self._entries = None
+        self._changed = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        entries = {}
+        if self.path:
+            try:
+                with open(self.path,'rb') as fd:
+                    entries = marshal.load(fd)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                ## corrupted or generated by an incompatible python
+                logDebug(f'[checksum] failed to load {self.path}, reason: {e}')
+        return entries
+
+    def get(self,host,path,size,mtime):
+        ## returns the sha256 or None if missed or stale
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            entry = self._entries.get(f'{host}\0{path}')
+        if entry and entry[0] == size and entry[1] == mtime:
+            return entry[2]
+
+    def put(self,host,path,size,mtime,digest):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            key = f'{host}\0{path}'
+            self._entries[key] = self._changed[key] = (size,mtime,digest)
+
+    def save(self):
+        with self._lock:
+            if not (self.path and self._changed): return
+            ## merge into entries saved by other processes meanwhile
+            entries = self._load()
+            entries.update(self._changed)
+            self._changed = {}
+        tmppath = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path),exist_ok=True)
+            with open(tmppath,'wb') as fd:
+                marshal.dump(entries,fd)
+            os.replace(tmppath,self.path)
+        except OSError as e:
+            logDebug(f'[checksum] failed to save {self.path}, reason: {e}')
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+        else:
+            logDebug8(f'[checksum] saved {len(entries)} entries to {self.path}')
+
+cache = None
+_cacheLock = threading.Lock()
+def getCache():
+    global cache
+    with _cacheLock:
+        if cache is None:
+            cache = ChecksumCache(cachePath())
+            atexit.register(cache.save)
+    return cache
+
+def hostKey(session):
+    return f'{session.username}@{session.host}:{session.port}'
+
+def localPath(path):
+    ## the key of a local file
+    return os.path.abspath(path)
+
+def remotePath(session,path):
+    ## the key of a remote file, relative paths are resolved by the sftp server (a round trip),
+    ## absolute paths are normalized locally, so unchanged files still cost only a stat
+    if posixpath.isabs(path):
+        return posixpath.normpath(path)
+    return session.sftp.normalize(path)
+
+def localDigest(path,st=None):
+    st = st or os.stat(path)
+    path = localPath(path)
+    digest = getCache().get('',path,st.st_size,st.st_mtime_ns)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path,'rb') as fd:
+            for chunk in iter(lambda: fd.read(1 << 20),b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        getCache().put('',path,st.st_size,st.st_mtime_ns,digest)
+    return digest
+
+def remoteDigest(session,path,attr):
+    ## attr: SFTPAttributes of the remote file
+    host = hostKey(session)
+    path = remotePath(session,path)
+    digest = getCache().get(host,path,attr.st_size,attr.st_mtime)
+    if digest is None:
+        quoted = shlex.quote(path)
+        command = f'sha256sum -- {quoted} 2>/dev/null || shasum -a 256 {quoted}'
+        exitcode, stdout, stderr = sshscripttransfer.execCommand(session.scheduler,command,sshscripttransfer.commandTimeout())
+        if exitcode != 0:
+            logDebug(f'[checksum] {command} failed:{stderr.decode("utf8","replace").strip()}')
+            return None
+        digest = stdout.split()[0].decode()
+        getCache().put(host,path,attr.st_size,attr.st_mtime,digest)
+    return digest
+
+def unchangedUpload(session,src,dst):
+    ## whether the remote file dst has the same content as the local file src
+    try:
+        attr = session.sftp.stat(dst)
+    except FileNotFoundError:
+        return False
+    st = os.stat(src)
+    if not stat.S_ISREG(attr.st_mode) or attr.st_size != st.st_size:
+        return False
+    return localDigest(src,st) == remoteDigest(session,dst,attr)
+
+def unchangedDownload(session,src,dst):
+    ## whether the local file dst has the same content as the remote file src
+    try:
+        st = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    attr = session.sftp.stat(src)
+    if not stat.S_ISREG(st.st_mode) or attr.st_size != st.st_size:
+        return False
+    return localDigest(dst,st) == remoteDigest(session,src,attr)
+
+def uploaded(session,src,dst,attr):
+    ## after uploading, the remote file has the digest of the local file
+    ## attr: returned by sftp.put(), SFTPAttributes of dst
+    getCache().put(hostKey(session),remotePath(session,dst),attr.st_size,attr.st_mtime,localDigest(src))
+
+def downloaded(session,src,dst,attr):
+    ## after downloading, the remote file has the digest of the local file
+    ## attr: SFTPAttributes of src before downloading, nothing is cached if src has been changed meanwhile
+    after = session.sftp.stat(src)
+    if (after.st_size,after.st_mtime) == (attr.st_size,attr.st_mtime):
+        getCache().put(hostKey(session),remotePath(session,src),attr.st_size,attr.st_mtime,localDigest(dst))
@@ -14,17 +14,22 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
 #
 
-import os, re, sys, time
+import os, re, sys, time, io, uuid
 import subprocess, shlex
+import selectors
 from logging import DEBUG
 import __main__
 import shutil
 try:
     from .sshscripterror import SSHScriptError,logDebug8, logDebug
     from .sshscriptchannel import POpenChannel, ParamikoChannel
+    from .sshscriptchannelutils import LineAssembler, DelimiterSplitter
+    from . import sshscriptworker
 except ImportError:
     from sshscripterror import SSHScriptError,logDebug8, logDebug
     from sshscriptchannel import POpenChannel, ParamikoChannel
+    from sshscriptchannelutils import LineAssembler, DelimiterSplitter
+    import sshscriptworker
 
 try:
     import pty
@@ -87,7 +92,11 @@ class SSHScriptDollar(object):
         self._stderr = lambda: ""
         self._rawstdout = lambda: ""
         self._rawstderr = lambda: ""
+        self._openstdout = lambda text=False: io.StringIO() if text else io.BytesIO()
+        self._openstderr = lambda text=False: io.StringIO() if text else io.BytesIO()
         self.exitcode = None
+        ## v2.0.3, [(end of stdout, end of stderr, exitcode), ...] of every line of one-dollar
+        self.lineOutputs = []
         self.inWith = inWith
         self.shellToRun = None
         self.wrapper = None
@@ -118,6 +127,35 @@ class SSHScriptDollar(object):
     def rawstderr(self):
         return self._rawstderr()
 
+    ## v2.0.3, read large outputs in a streaming way, eg.
+    ##    $cat /var/log/big.log
+    ##    with $.openstdout(text=True) as fd:
+    ##        for line in fd: ...
+    ## v2.0.3, [(stdout, stderr, exitcode), ...] of every executed line of a one-dollar, eg.
+    ##    $ls /tmp
+    ##     ls /nonexist
+    ##    for stdout, stderr, exitcode in $.results: ...
+    @property
+    @export2Dollar
+    def results(self):
+        results = []
+        if not self.lineOutputs: return results
+        stdoutData = self.channel.stdoutOutput.buffer()
+        stderrData = self.channel.stderrOutput.buffer()
+        stdoutStart = stderrStart = 0
+        for stdoutEnd, stderrEnd, exitcode in self.lineOutputs:
+            results.append((bytes(stdoutData[stdoutStart:stdoutEnd]).decode('utf8','replace'),
+                bytes(stderrData[stderrStart:stderrEnd]).decode('utf8','replace'),exitcode))
+            stdoutStart, stderrStart = stdoutEnd, stderrEnd
+        return results
+
+    @export2Dollar
+    def openstdout(self,text=False):
+        return self._openstdout(text)
+    @export2Dollar
+    def openstderr(self,text=False):
+        return self._openstderr(text)
+
     @property
     def waitingInterval(self):
         ## v2.0 CMD_INTERVAL and SSH_CMD_INTERVAL renamed to OUTPUT_TIMEOUT and SSH_OUTPUT_TIMEOUT
@@ -319,12 +357,12 @@ class SSHScriptDollar(object):
                 else:
                     args = shlex.split(command)
                 
-                ## this is more simple
-                ret = subprocess.run(args,stderr=subprocess.PIPE,stdout=subprocess.PIPE)
-                self.exitcode = ret.returncode
-                ## for multiple commands, add all output to $.stdout, $.stderr
-                self.channel.addStdoutData(ret.stdout)
-                self.channel.addStderrData(ret.stderr)
+                ## v2.0.3, outputs are added chunk by chunk, then large outputs are spilled
+                ## to temporary files instead of being kept in memory entirely by subprocess.run()
+                for data in self.iterSubprocess(args):
+                    self.channel.addStdoutData(data)
+                ## v2.0.3, for $.results, as execBySSH() does
+                self.lineOutputs.append((len(self.channel.stdoutOutput),len(self.channel.stderrOutput),self.exitcode))
 
                 error = self.checkExitcode(self.exitcode,self.channel.stderr)
                 if error:
@@ -340,6 +378,51 @@ class SSHScriptDollar(object):
             ## ex. $, $@{}, $f''
             logDebug8(f'[subprocess]nothing to do.')
 
+    def iterSubprocess(self,args):
+        ## v2.0.3, yields stdout of the subprocess chunk by chunk, stderr is added to self.channel.
+        ## self.exitcode is assigned when the subprocess has completed.
+        if sys.platform  == 'win32':
+            ## selectors do not work on pipes of Windows, this is more simple
+            ret = subprocess.run(args,stderr=subprocess.PIPE,stdout=subprocess.PIPE)
+            self.channel.addStderrData(ret.stderr)
+            if ret.stdout: yield ret.stdout
+            self.exitcode = ret.returncode
+            return
+        if self.sshscript._localWorker:
+            ## v2.0.3, executed by a persistent shell, in the current directory and os.environ
+            worker = sshscriptworker.getPool().acquire()
+            try:
+                prelude = worker.prelude(os.getcwd(),os.environ)
+                if prelude is not None:
+                    yield from worker.execute(args,self.channel.addStderrData,prelude)
+                    self.exitcode = worker.exitcode
+            finally:
+                sshscriptworker.getPool().release(worker)
+            if prelude is not None: return
+            logDebug8('[subprocess] os.environ can not be applied by the worker, use Popen')
+        cp = subprocess.Popen(args,stderr=subprocess.PIPE,stdout=subprocess.PIPE)
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(cp.stdout,selectors.EVENT_READ,True)
+                selector.register(cp.stderr,selectors.EVENT_READ,False)
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        data = os.read(key.fd,65536)
+                        if not data:
+                            selector.unregister(key.fileobj)
+                        elif key.data:
+                            yield data
+                        else:
+                            self.channel.addStderrData(data)
+            self.exitcode = cp.wait()
+        finally:
+            ## the consumer might stop iterating before the subprocess completed
+            if cp.poll() is None:
+                cp.kill()
+                cp.wait()
+            cp.stdout.close()
+            cp.stderr.close()
+
     def checkExitcode(self,exitcode,mesg):
         if self.sshscript._careful and (not exitcode == 0):
             return SSHScriptError(mesg,code=exitcode)
@@ -389,33 +472,175 @@ class SSHScriptDollar(object):
         else:
             ## one-dollar
             self.channel = ParamikoChannel(self,None)
-            for command in cmds:
-                logDebug(f'[{host}]paramiko exec_command:{command},timeout={self.commandTimeoutSSH}')
-                ## The paramiko documentation says:
-                ## "using exec_command or invoke_shell without a pty will ever have data on the stderr stream."
-                ## So, we always need not a pty.
-                #assert client._transport.is_active()
-                _, stdout,stderr = client.exec_command(command,get_pty=0,timeout=self.commandTimeoutSSH)
-                endtime = time.time() + self.commandTimeoutSSH
-                self.channel.addStdoutData(stdout.read())
-                self.channel.addStderrData(stderr.read())
-                ## to do: currently the execution time is limited to 60 seconds
-                ##        user should set os.environ['CMD_TIMEOUT'] to change it.
-                ##        should allow user to change the execution time easily in the future
-                while not (stdout.channel.exit_status_ready()):
-                    time.sleep(0.01)
-                    if time.time() >= endtime:
-                        ## 產生 console.stdout,console.stderr (why?)
-                        self.channel.updateStdoutStderr('one-dollar timeout')
-                        raise TimeoutError(f'exec_command:{command};{self.channel.stderr}')
-                self.exitcode = stdout.channel.recv_exit_status()
-                logDebug(f'[{host}]exitcode={self.exitcode}')
-                
+            if self.sshscript._useAgent:
+                ## v2.0.3, by the helper agent over a long-lived channel
+                self.execByAgent(cmds)
+            elif self.sshscript._batch and len(cmds) > 1:
+                ## v2.0.3, all lines in a single exec_command()
+                self.execBatchBySSH(cmds)
                 error = self.checkExitcode(self.exitcode,self.channel.stderr)
                 if error:
                     self.channel.close()
                     raise error
+            else:
+                for command in cmds:
+                    logDebug(f'[{host}]paramiko exec_command:{command},timeout={self.commandTimeoutSSH}')
+                    #assert client._transport.is_active()
+                    for data in self.iterExecCommand(command):
+                        self.channel.addStdoutData(data)
+                    logDebug(f'[{host}]exitcode={self.exitcode}')
+                    self.lineOutputs.append((len(self.channel.stdoutOutput),len(self.channel.stderrOutput),self.exitcode))
+
+                    error = self.checkExitcode(self.exitcode,self.channel.stderr)
+                    if error:
+                        self.channel.close()
+                        raise error
 
             ## self.channel.close() will set up self._stdout and self._stderr
             self.channel.close()
 
+    def execBatchBySSH(self,cmds):
+        ## v2.0.3, executes lines of a one-dollar by a single exec_command() to save round trips of
+        ## opening a channel for every line. Every line is evaluated in a subshell (like it was executed
+        ## alone, a syntax error would not break the batch), then a delimiter carrying its exitcode is printed to both stdout and stderr.
+        ## The remote shell should be a POSIX shell.
+        host = self.sshscript.host
+        token = f'__sshscript_{uuid.uuid4().hex}_'
+        script = []
+        for idx, command in enumerate(cmds):
+            script.append(f'(eval {shlex.quote(command)})')
+            script.append(f"__rc=$?; printf '{token}{idx}--%d--\\n' $__rc; printf '{token}{idx}--%d--\\n' $__rc >&2")
+            if self.sshscript._careful:
+                ## stop at the failed line, as it was executed line by line
+                script.append('[ $__rc -eq 0 ] || exit $__rc')
+        script = '\n'.join(script)
+        logDebug(f'[{host}]paramiko exec_command (batch of {len(cmds)} lines),timeout={self.commandTimeoutSSH}')
+        logDebug8(script)
+        stdoutSplitter = DelimiterSplitter(token,self.channel.addStdoutData)
+        stderrSplitter = DelimiterSplitter(token,self.channel.addStderrData)
+        for data in self.iterExecCommand(script,stderrSplitter.feed):
+            stdoutSplitter.feed(data)
+        stdoutSplitter.flush()
+        stderrSplitter.flush()
+        ## self.exitcode is the exitcode of the batch now
+        batchExitcode = self.exitcode
+        stderrEnds = [x[2] for x in stderrSplitter.delimiters]
+        for idx, exitcode, stdoutEnd in stdoutSplitter.delimiters:
+            stderrEnd = stderrEnds[idx] if idx < len(stderrEnds) else stderrSplitter.size
+            self.lineOutputs.append((stdoutEnd,stderrEnd,exitcode))
+            self.exitcode = exitcode
+        if len(self.lineOutputs) < len(cmds) and (not self.lineOutputs or self.lineOutputs[-1][2] != batchExitcode):
+            ## the batch was broken by a line without delimiter (eg. syntax error, or "exec" in the line)
+            self.lineOutputs.append((stdoutSplitter.size,stderrSplitter.size,batchExitcode))
+            self.exitcode = batchExitcode
+        logDebug(f'[{host}]exitcodes={[x[2] for x in self.lineOutputs]}')
+
+    def execByAgent(self,cmds):
+        ## v2.0.3, executes lines of a one-dollar by the helper agent (see sshscriptagent).
+        ## Lines are executed in order by the agent. Without careful(), all lines are submitted at once,
+        ## so there is no round trip between lines. With careful(), a line is submitted after
+        ## the previous one has succeeded.
+        host = self.sshscript.host
+        agent = self.sshscript.getAgent()
+        requests = [] if self.sshscript._careful else [agent.submit(command) for command in cmds]
+        for idx, command in enumerate(cmds):
+            request = requests[idx] if requests else agent.submit(command)
+            logDebug(f'[{host}]agent exec:{command},timeout={self.commandTimeoutSSH}')
+            try:
+                for kind, data in request.iterOutput(self.commandTimeoutSSH):
+                    if kind == 'stdout':
+                        self.channel.addStdoutData(data)
+                    else:
+                        self.channel.addStderrData(data)
+            except TimeoutError:
+                self.channel.updateStdoutStderr('one-dollar timeout')
+                ## the agent executes requests in order and it is still running the command,
+                ## later commands would wait behind it, so the agent is closed and restarted on demand
+                logDebug(f'[{host}]agent timeout, closing {agent}')
+                self.sshscript.dropAgent(agent)
+                raise TimeoutError(f'agent:{command};{self.channel.stderr}')
+            self.exitcode = request.exitcode
+            logDebug(f'[{host}]exitcode={self.exitcode},elapsed={request.elapsed}')
+            self.lineOutputs.append((len(self.channel.stdoutOutput),len(self.channel.stderrOutput),self.exitcode))
+
+            error = self.checkExitcode(self.exitcode,self.channel.stderr)
+            if error:
+                self.channel.close()
+                raise error
+
+    def iterExecCommand(self,command,addStderrData=None):
+        ## v2.0.3, yields stdout of the command executed by exec_command() chunk by chunk,
+        ## stderr is added to self.channel (or given to addStderrData).
+        ## self.exitcode is assigned when the command has completed.
+        ## The paramiko documentation says:
+        ## "using exec_command or invoke_shell without a pty will ever have data on the stderr stream."
+        ## So, we always need not a pty.
+        ## The channel is opened by the scheduler, it waits when too many channels are opened on the connection.
+        scheduler = self.sshscript.scheduler
+        channel = scheduler.openSession(self.commandTimeoutSSH)
+        addStderrData = addStderrData or self.channel.addStderrData
+        try:
+            channel.settimeout(self.commandTimeoutSSH)
+            channel.exec_command(command)
+            ## v2.0.3, drain stdout and stderr concurrently, otherwise a command writes a lot to stderr
+            ## would stall when the window was filled by unread stderr.
+            ## channel.fileno() is readable when either of them has data or the channel got eof.
+            with selectors.DefaultSelector() as selector:
+                selector.register(channel,selectors.EVENT_READ)
+                while True:
+                    received = False
+                    if channel.recv_stderr_ready():
+                        addStderrData(channel.recv_stderr(65536))
+                        received = True
+                    if channel.recv_ready():
+                        ## channel.recv() returns data as soon as it arrived, stdout.read(n) waits for n bytes
+                        data = channel.recv(65536)
+                        received = True
+                        if data: yield data
+                    if received:
+                        continue
+                    elif channel.eof_received or channel.closed:
+                        break
+                    elif not selector.select(self.commandTimeoutSSH):
+                        ## 產生 console.stdout,console.stderr (why?)
+                        self.channel.updateStdoutStderr('one-dollar timeout')
+                        raise TimeoutError(f'exec_command:{command};{self.channel.stderr}')
+            ## the exit status usually arrives along with the eof, wait for it by event instead of polling
+            if not channel.status_event.wait(self.commandTimeoutSSH):
+                self.channel.updateStdoutStderr('one-dollar timeout')
+                raise TimeoutError(f'exec_command:{command};{self.channel.stderr}')
+            self.exitcode = channel.recv_exit_status()
+        finally:
+            channel.close()
+            scheduler.release(channel)
+
+    def iterLines(self):
+        ## v2.0.3, executes the command(s) as one-dollar and yields lines (str, without newline)
+        ## of stdout as they arrive. stdout is not kept, so the memory usage is bounded by
+        ## the longest line. $.stderr and $.exitcode are available when the iteration has completed.
+        cmds = [x for x in self.evalCommand() if not x.startswith('#')]
+        host = self.sshscript.host
+        if host:
+            self.channel = ParamikoChannel(self,None)
+        else:
+            self.channel = POpenChannel(self,None,None,None,None)
+        self.sshscript._lastDollar = self
+        try:
+            for command in cmds:
+                if host:
+                    logDebug(f'[{host}]paramiko exec_command:{command},timeout={self.commandTimeoutSSH}')
+                    stream = self.iterExecCommand(command)
+                else:
+                    logDebug(f'[subprocess] exec:{command}')
+                    stream = self.iterSubprocess(command if sys.platform  == 'win32' else shlex.split(command))
+                assembler = LineAssembler()
+                for data in stream:
+                    for line in (assembler.feed(data) or ()):
+                        yield line.decode('utf8','replace')
+                line = assembler.flush()
+                if line: yield line.decode('utf8','replace')
+
+                error = self.checkExitcode(self.exitcode,self.channel.stderr)
+                if error: raise error
+        finally:
+            self.channel.close()
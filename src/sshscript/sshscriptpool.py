@@ -0,0 +1,145 @@
+# Copyright (C) 2022-2026  Hsin Yuan Yeh <iapyeh@gmail.com>
+#
+# This file is part of Sshscript.
+#
+# SSHScript is free software; you can redistribute it and/or modify it under the
+# terms of the MIT License.
+#
+# SSHScript is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the MIT License for more details.
+#
+# You should have received a copy of the MIT License along with SSHScript;
+# if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+'''
+Process-level pool of authenticated paramiko.SSHClient (v2.0.3)
+
+When enabled, SSHScriptSession.close() (also "with $.connect() as ..." exits)
+returns the client into this pool instead of closing it, and the next
+SSHScriptSession.connect() to the same username@host:port takes it back.
+So, only the first connection pays the TCP handshake, key exchange and authentication.
+
+Nested connections (direct-tcpip over a parent connection) are pooled too,
+they are keyed by the parent's transport as well.
+
+Environment variables:
+    SSHSCRIPT_POOL=1                  : enable the pool (or $.connect(..., pool=True))
+    SSHSCRIPT_POOL_SIZE=8             : max number of idle clients kept in the pool
+    SSHSCRIPT_POOL_IDLE_TIMEOUT=300   : idle clients over this seconds would be closed
+'''
+import os
+import time
+import atexit
+import threading
+try:
+    from .sshscripterror import logDebug, logDebug8
+except ImportError:
+    from sshscripterror import logDebug, logDebug8
+
+def enabled():
+    return os.environ.get('SSHSCRIPT_POOL','') not in ('','0','no','false')
+
+class SSHClientPool(object):
+    def __init__(self,maxSize=8,idleTimeout=300):
+        self.maxSize = maxSize
+        self.idleTimeout = idleTimeout
+        ## key => [(client, sock, checkin time), ...], the last one is the most recently used
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(x) for x in self._idle.values())
+
+    def __repr__(self):
+        return f'<SSHClientPool idle={len(self)},hits={self.hits},misses={self.misses},evictions={self.evictions}>'
+
+    @staticmethod
+    def healthy(client):
+        ## health check, it does not send anything to the remote
+        transport = client.get_transport()
+        return transport is not None and transport.is_active() and transport.is_authenticated()
+
+    @staticmethod
+    def _close(client,sock):
+        try:
+            client.close()
+            if sock: sock.close()
+        except Exception as e:
+            logDebug(f'[pool] error on closing {client}:{e}')
+
+    def _expired(self,now):
+        ## should be called with self._lock acquired
+        expired = []
+        for key,entries in list(self._idle.items()):
+            while entries and now - entries[0][2] > self.idleTimeout:
+                expired.append(entries.pop(0))
+            if not entries: del self._idle[key]
+        self.evictions += len(expired)
+        return expired
+
+    def checkout(self,key):
+        ## returns (client, sock) or None
+        now = time.time()
+        toClose = []
+        found = None
+        with self._lock:
+            toClose.extend(self._expired(now))
+            entries = self._idle.get(key)
+            while entries:
+                client, sock, _ = entries.pop()
+                if self.healthy(client):
+                    found = (client, sock)
+                    break
+                toClose.append((client, sock, None))
+            if entries is not None and not entries: del self._idle[key]
+            if found: self.hits += 1
+            else: self.misses += 1
+        for client, sock, _ in toClose: self._close(client, sock)
+        logDebug8(f'[pool] checkout {key}, {"hit" if found else "miss"}')
+        return found
+
+    def checkin(self,key,client,sock):
+        ## returns False if the client was not taken by the pool (caller should close it)
+        if self.maxSize <= 0 or not self.healthy(client): return False
+        toClose = []
+        with self._lock:
+            toClose.extend(self._expired(time.time()))
+            total = sum(len(x) for x in self._idle.values())
+            while total >= self.maxSize:
+                ## evict the least recently used
+                oldestKey = min(self._idle, key=lambda k: self._idle[k][0][2])
+                toClose.append(self._idle[oldestKey].pop(0))
+                if not self._idle[oldestKey]: del self._idle[oldestKey]
+                self.evictions += 1
+                total -= 1
+            self._idle.setdefault(key,[]).append((client, sock, time.time()))
+        for _client, _sock, _ in toClose: self._close(_client, _sock)
+        logDebug8(f'[pool] checkin {key}')
+        return True
+
+    def clear(self):
+        with self._lock:
+            entries = [y for x in self._idle.values() for y in x]
+            self._idle.clear()
+        ## nested connections are closed before their parents (sorted by checkin time),
+        ## because SSHScriptSession.close() closes (checks in) subsessions in advance
+        entries.sort(key=lambda x: x[2])
+        for client, sock, _ in entries: self._close(client, sock)
+
+pool = None
+_poolLock = threading.Lock()
+def getPool():
+    global pool
+    with _poolLock:
+        if pool is None:
+            pool = SSHClientPool(
+                maxSize=int(os.environ.get('SSHSCRIPT_POOL_SIZE',8)),
+                idleTimeout=float(os.environ.get('SSHSCRIPT_POOL_IDLE_TIMEOUT',300)))
+            atexit.register(pool.clear)
+    return pool
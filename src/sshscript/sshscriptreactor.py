@@ -0,0 +1,128 @@
+# Copyright (C) 2022-2026  Hsin Yuan Yeh <iapyeh@gmail.com>
+#
+# This file is part of Sshscript.
+#
+# SSHScript is free software; you can redistribute it and/or modify it under the
+# terms of the MIT License.
+#
+# SSHScript is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the MIT License for more details.
+#
+# You should have received a copy of the MIT License along with SSHScript;
+# if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+'''
+Shared I/O reactor for reading channels (v2.0.3)
+
+Instead of starting a reading thread for every POpenChannel and ParamikoChannel,
+channels register their readable file descriptors (pty, pipe, or the fileno() of
+a paramiko.Channel) here. A single thread waits on all of them by a selector and
+calls the registered callback when a descriptor is readable.
+
+The callback is called in the reactor's thread, it should not block.
+If the callback returns False, the descriptor is unregistered.
+
+Note that the listeners of channels (set by console.iterate()) and
+the dumping of VERBOSE mode are called by the callbacks, so they run in the
+reactor's thread too. A slow listener delays the reading of all channels,
+listeners should hand heavy work off to other threads.
+'''
+import socket
+import selectors
+import threading
+import traceback
+try:
+    from .sshscripterror import logDebug, logDebug8
+except ImportError:
+    from sshscripterror import logDebug, logDebug8
+
+class Reactor(object):
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        ## guarding modifications of self._selector
+        self._lock = threading.Lock()
+        ## held by the reactor's thread while calling callbacks,
+        ## unregister() acquires it to ensure the callback would not be called after it returns.
+        self._dispatchLock = threading.RLock()
+        ## for waking up the select() when descriptors were registered or unregistered
+        self._wakeupReader, self._wakeupWriter = socket.socketpair()
+        self._wakeupReader.setblocking(False)
+        self._wakeupWriter.setblocking(False)
+        self._selector.register(self._wakeupReader,selectors.EVENT_READ,None)
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            ## exclude the wakeup socket
+            return len(self._selector.get_map()) - 1
+
+    def _wakeup(self):
+        try:
+            self._wakeupWriter.send(b'\0')
+        except (BlockingIOError,OSError):
+            ## already has pending wakeup bytes
+            pass
+
+    def register(self,fileobj,callback):
+        ## fileobj: an int file descriptor or an object with fileno()
+        with self._lock:
+            try:
+                self._selector.register(fileobj,selectors.EVENT_READ,callback)
+            except KeyError:
+                ## the descriptor was closed without being unregistered and its number was reused
+                logDebug(f'[reactor] {fileobj} was registered, replacing its callback')
+                self._selector.modify(fileobj,selectors.EVENT_READ,callback)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,name='sshscript-reactor',daemon=True)
+                self._thread.start()
+        self._wakeup()
+
+    def unregister(self,fileobj):
+        ## It is safe to close the fileobj after this call returned.
+        with self._dispatchLock:
+            self._unregister(fileobj)
+        self._wakeup()
+
+    def _unregister(self,fileobj):
+        with self._lock:
+            try:
+                self._selector.unregister(fileobj)
+            except (KeyError,ValueError):
+                ## already unregistered
+                pass
+
+    def _run(self):
+        logDebug8('[reactor] started')
+        while True:
+            events = self._selector.select(1)
+            with self._dispatchLock:
+                for key, _ in events:
+                    if key.data is None:
+                        try:
+                            while self._wakeupReader.recv(4096): pass
+                        except BlockingIOError:
+                            pass
+                        continue
+                    with self._lock:
+                        ## might be unregistered by other callbacks in this round
+                        current = self._selector.get_map().get(key.fileobj)
+                    if current is None or current.data is not key.data: continue
+                    try:
+                        keep = key.data(key.fileobj)
+                    except Exception as e:
+                        logDebug(f'[reactor] callback of {key.fileobj} failed: {e}')
+                        logDebug(traceback.format_exc())
+                        keep = False
+                    if keep is False:
+                        self._unregister(key.fileobj)
+
+reactor = None
+_reactorLock = threading.Lock()
+def getReactor():
+    global reactor
+    with _reactorLock:
+        if reactor is None:
+            reactor = Reactor()
+    return reactor
@@ -0,0 +1,286 @@
+# Copyright (C) 2022-2026  Hsin Yuan Yeh <iapyeh@gmail.com>
+#
+# This file is part of Sshscript.
+#
+# SSHScript is free software; you can redistribute it and/or modify it under the
+# terms of the MIT License.
+#
+# SSHScript is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the MIT License for more details.
+#
+# You should have received a copy of the MIT License along with SSHScript;
+# if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+'''
+Scheduler of session channels of a connection (v2.0.3)
+
+sshd rejects opening more session channels than its MaxSessions (default to 10)
+on a connection. So, when many threads run $ or $$ on the same host, channels
+are opened through the scheduler of the connection. Channels over the limit
+wait in a queue until others were released, instead of failing.
+
+There is one scheduler per transport (see getScheduler()), so sessions sharing
+a connection (eg. by threads, or reused from the pool) share its limit.
+Every channel of openSession() should be given back by release(), and every
+getScheduler() should be paired with detach(), overflow clients are closed when
+the last session has detached.
+
+When the limit is saturated, the scheduler can open extra connections to the same
+host (overflow clients), and channels are opened on the least loaded connection.
+Overflow is only available for direct connections (not nested or by proxyCommand).
+If sshd rejects a channel under the limit (MaxSessions is lower than the limit),
+the limit of that connection is lowered to the number of its opened channels.
+
+Environment variables:
+    SSHSCRIPT_MAX_CHANNELS=10      : max channels opened at the same time per connection (0 for unlimited)
+    SSHSCRIPT_OVERFLOW_CLIENTS=0   : max number of extra connections to the same host
+'''
+import os
+import time
+import threading
+import paramiko
+try:
+    from .sshscripterror import logDebug, logDebug8
+except ImportError:
+    from sshscripterror import logDebug, logDebug8
+
+class ChannelScheduler(object):
+    def __init__(self,client,maxChannels=10,maxOverflow=0,connect=None):
+        ## connect: callable to open an overflow client, None to disable overflow
+        self.maxChannels = maxChannels
+        self._maxOverflow = maxOverflow
+        self.maxOverflow = maxOverflow if connect else 0
+        self.connect = connect
+        ## [client, ...], the first one is the session's client
+        self.clients = [client]
+        ## client => [channel, ...] opened (or being opened) on the client, None is a reserved slot
+        self._channels = {client:[]}
+        ## client => limit lowered by rejections of sshd
+        self._limits = {}
+        self._cond = threading.Condition()
+        self._connecting = False
+        ## [(event loop, future), ...] of asyncio callers waiting for a free slot
+        self._asyncWaiters = []
+        ## [connect, ...] of sessions using the scheduler (see attach())
+        self._users = []
+        ## metrics
+        self.opened = 0
+        self.waited = 0
+        self.waitTime = 0.0
+        self.maxWaitTime = 0.0
+        self.queued = 0
+        self.rejected = 0
+
+    def __repr__(self):
+        return f'<ChannelScheduler {self.stats()}>'
+
+    def stats(self):
+        with self._cond:
+            return {
+                'clients':len(self.clients),
+                'channels':sum(len(x) for x in self._channels.values()),
+                'queued':self.queued,
+                'opened':self.opened,
+                'waited':self.waited,
+                'waitTime':self.waitTime,
+                'maxWaitTime':self.maxWaitTime,
+                'rejected':self.rejected,
+            }
+
+    def _limit(self,client):
+        return self._limits.get(client,self.maxChannels)
+
+    def _reap(self):
+        ## channels closed without release() (eg. by errors) give their slots back
+        for channels in self._channels.values():
+            channels[:] = [x for x in channels if x is None or not x.closed]
+
+    def _active(self,client):
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _available(self):
+        ## returns the least loaded active client which has a free slot, or None
+        candidates = []
+        for client in self.clients:
+            if not self._active(client): continue
+            count = len(self._channels[client])
+            if self.maxChannels <= 0 or count < self._limit(client):
+                candidates.append((count,client))
+        if candidates:
+            return min(candidates,key=lambda x: x[0])[1]
+
+    def _notify(self):
+        ## wakes up waiters of a free slot, called with self._cond held
+        self._cond.notify_all()
+        waiters, self._asyncWaiters = self._asyncWaiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(self._wakeAsyncWaiter,future)
+            except RuntimeError:
+                ## the event loop was closed
+                pass
+
+    def _overflow(self):
+        ## open an extra client to the same host, called without holding self._cond
+        try:
+            client = self.connect()
+        except Exception as e:
+            logDebug(f'[scheduler] failed to open an overflow client: {e}')
+            client = None
+        with self._cond:
+            self._connecting = False
+            if client is None:
+                ## do not retry
+                self.maxOverflow = len(self.clients) - 1
+            else:
+                self.clients.append(client)
+                self._channels[client] = []
+                logDebug8(f'[scheduler] opened overflow client #{len(self.clients)-1}')
+            self._notify()
+
+    def openSession(self,timeout=None,wait=True,windowSize=None,maxPacketSize=None,waiter=None):
+        ## returns a paramiko.Channel of a new session, it should be given back by release()
+        ## wait: if False, returns None instead of waiting when no slot is available
+        ## windowSize, maxPacketSize: of the channel, default to those of the transport
+        ## waiter: (event loop, future), with wait=False, the future is resolved when a slot might be free
+        ## (see tryOpenOrWait())
+        start = time.time()
+        endtime = None if timeout is None else start + timeout
+        waited = False
+        while True:
+            with self._cond:
+                while True:
+                    self._reap()
+                    if not any(self._active(x) for x in self.clients):
+                        raise paramiko.SSHException('SSH session not active')
+                    client = self._available()
+                    if client is not None:
+                        ## reserve a slot
+                        self._channels[client].append(None)
+                        break
+                    if (not self._connecting) and len(self.clients) <= self.maxOverflow:
+                        self._connecting = True
+                        break
+                    if not wait:
+                        ## registered under the same lock as the check, so a release() in between is not missed
+                        if waiter is not None: self._asyncWaiters.append(waiter)
+                        return None
+                    remaining = None if endtime is None else endtime - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f'no channel available in {timeout} seconds, {self.stats()}')
+                    if not waited:
+                        waited = True
+                        self.waited += 1
+                    self.queued += 1
+                    try:
+                        ## notified by release()
+                        self._cond.wait(remaining)
+                    finally:
+                        self.queued -= 1
+            if client is None:
+                self._overflow()
+                continue
+            try:
+                channel = client.get_transport().open_session(window_size=windowSize,max_packet_size=maxPacketSize,timeout=timeout)
+            except paramiko.SSHException as e:
+                ## rejected by sshd, its MaxSessions is lower than self.maxChannels.
+                ## paramiko raises SSHException instead of ChannelException when channels were rejected concurrently.
+                with self._cond:
+                    if not self._active(client):
+                        self._channels[client].remove(None)
+                        self._notify()
+                        raise
+                    self._channels[client].remove(None)
+                    self.rejected += 1
+                    self._limits[client] = max(1,len(self._channels[client]))
+                    logDebug(f'[scheduler] channel rejected ({e}), limit is lowered to {self._limits[client]}')
+                    if not self._channels[client]:
+                        ## nothing to wait for
+                        raise
+                continue
+            except:
+                with self._cond:
+                    self._channels[client].remove(None)
+                    self._notify()
+                raise
+            with self._cond:
+                self._channels[client].remove(None)
+                self._channels[client].append(channel)
+                self.opened += 1
+                if waited:
+                    waitTime = time.time() - start
+                    self.waitTime += waitTime
+                    self.maxWaitTime = max(self.maxWaitTime,waitTime)
+            return channel
+
+    def release(self,channel):
+        ## should be called after the channel was closed, calling it twice is harmless
+        with self._cond:
+            for channels in self._channels.values():
+                if channel in channels:
+                    channels.remove(channel)
+                    break
+            self._notify()
+
+    @staticmethod
+    def _wakeAsyncWaiter(future):
+        if not future.done(): future.set_result(None)
+
+    def tryOpenOrWait(self,loop,future,timeout=None):
+        ## returns a channel, or None after future was registered to be resolved in loop
+        ## when a slot might be free (see sshscriptasync), call it again then.
+        return self.openSession(timeout,False,waiter=(loop,future))
+
+    def attach(self,connect=None):
+        ## called by getScheduler() for every session using the scheduler
+        with self._cond:
+            self._users.append(connect)
+            if connect and self.connect is None:
+                self.connect = connect
+                self.maxOverflow = self._maxOverflow
+
+    def detach(self,connect=None):
+        ## called when a session stops using the scheduler, the last one closes overflow clients
+        with self._cond:
+            if connect in self._users: self._users.remove(connect)
+            if self.connect is connect:
+                ## overflow clients are opened by a session still using the scheduler
+                self.connect = next((x for x in reversed(self._users) if x),None)
+                if self.connect is None: self.maxOverflow = 0
+            if self._users: return
+        self.close()
+
+    def close(self):
+        ## close overflow clients, the first client is closed by the session
+        with self._cond:
+            clients = self.clients[1:]
+            del self.clients[1:]
+            for client in clients:
+                self._channels.pop(client,None)
+                self._limits.pop(client,None)
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                logDebug(f'[scheduler] error on closing {client}:{e}')
+
+_schedulerLock = threading.Lock()
+def getScheduler(client,connect=None):
+    ## returns the scheduler of the client's transport, it is created for the first caller,
+    ## and kept by the transport, so all sessions on the transport share it.
+    ## connect: see ChannelScheduler. The caller should call scheduler.detach(connect) when done.
+    transport = client.get_transport()
+    if transport is None: return None
+    with _schedulerLock:
+        scheduler = getattr(transport,'sshscriptScheduler',None)
+        if scheduler is None:
+            scheduler = ChannelScheduler(client,
+                maxChannels=int(os.environ.get('SSHSCRIPT_MAX_CHANNELS',10)),
+                maxOverflow=int(os.environ.get('SSHSCRIPT_OVERFLOW_CLIENTS',0)),
+                connect=connect)
+            transport.sshscriptScheduler = scheduler
+        scheduler.attach(connect)
+    return scheduler
@@ -45,6 +45,7 @@ import copy
 from io import StringIO
 from logging import DEBUG, WARN
 import types
+import concurrent.futures
 
 ## reason of "import setupLogger" in sshscriptsession: for user scrips need not to import sshscripterror by themselves
 ## they can only import sshscriptsession, and call sshscriptsession.setupLogger()
@@ -54,6 +55,14 @@ try:
     from .sshscriptchannelutils import InnerConsole
     from .sshscripterror import getLogger, SSHScriptError, SSHScriptExit, SSHScriptBreak, SSHScriptError, logDebug, logDebug8
     from . import sshscriptparser
+    from . import sshscriptcache
+    from . import sshscriptpool
+    from . import sshscriptworker
+    from . import sshscriptagent
+    from . import sshscriptscheduler
+    from . import sshscriptasync
+    from . import sshscripttransfer
+    from . import sshscriptchecksum
 except ImportError:
     ## called directly from the same folder
     from sshscriptdollar import SSHScriptDollar
@@ -61,6 +70,14 @@ except ImportError:
     from sshscriptchannelutils import InnerConsole
     from sshscripterror import getLogger, SSHScriptError, SSHScriptExit, SSHScriptBreak, SSHScriptError, logDebug, logDebug8
     import sshscriptparser
+    import sshscriptcache
+    import sshscriptpool
+    import sshscriptworker
+    import sshscriptagent
+    import sshscriptscheduler
+    import sshscriptasync
+    import sshscripttransfer
+    import sshscriptchecksum
 
 logger = getLogger()
 
@@ -89,6 +106,8 @@ paramiko.Transport.set_keepalive = my_set_keepalive
 
 ## looking for @include( to self.open( in Py
 pAtInclude = re.compile('^( *?)\$.include\(([^\)]+)\)',re.M)
+## v2.0.3, names which might be referenced by @{...} or f-strings of arun()
+pIdentifier = re.compile(r'[A-Za-z_]\w*')
 SSHScriptExportedNames = set(['sftp','client','logger']) # default to exposed properties
 SSHScriptExportedNamesByAlias = {}
 ## expose to __main__ for sshdollar.py
@@ -141,6 +160,30 @@ class ConsoleWrapper:
         self.withDollar.__exit__(exc_type, exc_value, traceback)
 
 
+class ParallelResult(object):
+    ## v2.0.3, result of one host in SSHScriptSession.parallel()
+    def __init__(self,index,host):
+        ## index: position of this host in the given hosts
+        self.index = index
+        self.host = host
+        self.stdout = ''
+        self.stderr = ''
+        self.exitcode = None
+        ## return value of the callable
+        self.value = None
+        ## exception raised by connecting or running, TimeoutError when per-host timeout was reached
+        self.error = None
+        self.started = None
+        ## seconds taken (including connecting)
+        self.elapsed = None
+    @property
+    def ok(self):
+        return self.error is None and (self.exitcode is None or self.exitcode == 0)
+    def __repr__(self):
+        state = 'ok' if self.ok else (f'error={self.error!r}' if self.error else f'exitcode={self.exitcode}')
+        elapsed = '-' if self.elapsed is None else f'{self.elapsed:.3f}s'
+        return f'<ParallelResult {self.host} {state} {elapsed}>'
+
 class SSHScriptSession(object):
     counter = 0
     
@@ -219,6 +262,10 @@ class SSHScriptSession(object):
         self._client = None
         self._sock =  None
         self._sftp = None
+        ## v2.0.3, stats of the last upload() or download()
+        self._transferStats = None
+        ## v2.0.3, key in sshscriptpool if the client would be returned to the pool when closing
+        self._poolKey = None
 
         self.blocksOfScript = None
        
@@ -234,6 +281,18 @@ class SSHScriptSession(object):
         ## todo: verify these two in threads
         self._careful = parent._careful if parent else False
         self._timeout = parent._timeout if parent else None #blocking
+        ## v2.0.3, execute lines of a one-dollar by a single exec_command() (see batch())
+        self._batch = parent._batch if parent else os.environ.get('SSHSCRIPT_BATCH','') not in ('','0','no','false')
+        ## v2.0.3, run local one-dollar commands by persistent shells (see sshscriptworker)
+        self._localWorker = parent._localWorker if parent else sshscriptworker.enabled()
+        ## v2.0.3, run remote one-dollar commands by the helper agent (see sshscriptagent)
+        self._useAgent = parent._useAgent if parent else sshscriptagent.enabled()
+        self._agent = None
+        self._agentLock = threading.Lock()
+        ## v2.0.3, session channels are opened by the scheduler (see sshscriptscheduler)
+        self._scheduler = None
+        ## callable to open another client to the same host, for overflow of the scheduler
+        self._connectAnother = None
         
         ## Line number count in total files (when showing source of multiple files)
         ## from v1.1.13, when --debug presented, don't show total count (better for debugging)
@@ -312,13 +371,40 @@ class SSHScriptSession(object):
                 return ret
             return wrapper
 
+    @property
+    def scheduler(self):
+        ## v2.0.3, the scheduler of the connection's transport, shared by sessions on it
+        if self._scheduler is None and self.client:
+            self._scheduler = sshscriptscheduler.getScheduler(self.client,self._connectAnother)
+        return self._scheduler
+
+    ## v2.0.3, metrics of channels of the connection, eg. {'queued':0,'waited':3,'waitTime':1.2,...}
+    @export2Dollar
+    def channelstats(self):
+        return self.scheduler.stats() if self.scheduler else {}
+
+    ## v2.0.3, {'bytes','seconds','MBps',...} of the last upload() or download(), None if it was skipped
+    @property
+    @export2Dollar
+    def transferstats(self):
+        return self._transferStats
+
+    def transferringSFTP(self,window,packet):
+        ## a dedicated SFTP client when the window size or max packet size is given, it should be closed after use
+        if window is None and packet is None: return self.sftp
+        _, _, window, packet = sshscripttransfer.transferOptions(window=window,packet=packet)
+        return sshscripttransfer.openSFTP(self.scheduler,window,packet)
+
     @property
     def sftp(self):
         assert self.connected
         if self._sftp is not None:
             return self._sftp
         elif self.client:
-            self._sftp = self.client.open_sftp()
+            ## v2.0.3, the sftp subsystem takes a session channel too,
+            ## its window size and max packet size are from SSHSCRIPT_SFTP_WINDOW and SSHSCRIPT_SFTP_PACKET
+            _, _, window, packet = sshscripttransfer.transferOptions()
+            self._sftp = sshscripttransfer.openSFTP(self.scheduler,window,packet)
             return self._sftp
         else:
             return None
@@ -339,6 +425,17 @@ class SSHScriptSession(object):
     def rawstderr(self):
         if self._lastDollar is None: raise ValueError('no execution result yet')
         return self._lastDollar.rawstderr
+    ## v2.0.3
+    @property
+    def results(self):
+        if self._lastDollar is None: raise ValueError('no execution result yet')
+        return self._lastDollar.results
+    def openstdout(self,text=False):
+        if self._lastDollar is None: raise ValueError('no execution result yet')
+        return self._lastDollar.openstdout(text)
+    def openstderr(self,text=False):
+        if self._lastDollar is None: raise ValueError('no execution result yet')
+        return self._lastDollar.openstderr(text)
     
     @property
     def exitcode(self):
@@ -435,7 +532,22 @@ class SSHScriptSession(object):
         inactive_callback = kw.get('inactive_callback')
         if inactive_callback: del kw['inactive_callback']
 
-        if self.client:
+        ## v2.0.3, connection pool (see sshscriptpool.py)
+        usePool = kw.pop('pool',None)
+        if usePool is None: usePool = sshscriptpool.enabled()
+        if usePool:
+            ## nested connections are keyed by the parent's transport, others by the proxyCommand (mostly None)
+            poolKey = (username,host,port,self.client.get_transport() if self.client else kw.get('proxyCommand'))
+            pooled = sshscriptpool.getPool().checkout(poolKey)
+            subsession._poolKey = poolKey
+        else:
+            pooled = None
+
+        if pooled:
+            subsession._client, subsession._sock = pooled
+            logDebug8(f'{self} has connected to {username}@{host}:{port} from pool,(subsession={subsession})')
+            self.subsessions.append(subsession)
+        elif self.client:
             ## a nested connection
             if 'proxyCommand' in kw:
                 raise NotImplementedError('proxyCommand not support in a nested session')
@@ -485,6 +597,11 @@ class SSHScriptSession(object):
             finally:
                 subsession.runLocker.release()  
 
+        if subsession._sock is None:
+            ## v2.0.3, overflow clients of the scheduler are connected by the same arguments
+            ## (not for nested connections or by proxyCommand)
+            subsession._connectAnother = lambda: connectClient(host,username,password,port,policy,**kw)
+
         ## keep alive (added from v1.1.18)
         keepAliveInterval = int(os.environ.get('SSHSCRIPT_KEEPALIVE_INTERVAL','60'))
         if keepAliveInterval:
@@ -499,6 +616,124 @@ class SSHScriptSession(object):
 
         return subsession
 
+    ## v2.0.3
+    @export2Dollar
+    def parallel(self,hosts,command,username=None,password=None,port=22,workers=None,timeout=None,failfast=False,stream=False,shell=False,**kw):
+        """
+        Connect to every host and run the same command or callable on them concurrently.
+        :hosts: list of "username@host" or dict of arguments to connect(), eg. {'host':'h1','port':2222}
+        :command: 
+            str: a $ command (or $$ command if shell is True), @{var} is evaluated in the caller's frame
+            callable: called by func(subsession), "$" in the callable refers to the subsession
+        :workers: max number of hosts to run at the same time, 
+            default to os.environ['SSHSCRIPT_PARALLEL_WORKERS'] or 32
+        :timeout: seconds allowed for every host (including connecting), the connection of the host
+            would be closed when reached, and its result.error would be a TimeoutError
+        :failfast: if True, stop starting hosts when any host failed (error or non-zero exitcode),
+            the result.error of hosts not started would be concurrent.futures.CancelledError
+        :stream: if True, returns an iterator which yields ParallelResult in order of completion.
+            Otherwise, returns a list of ParallelResult in order of the given hosts.
+        Other keyword arguments are passed to connect().
+        """
+        hosts = list(hosts)
+        if workers is None:
+            workers = int(os.environ.get('SSHSCRIPT_PARALLEL_WORKERS',32))
+        workers = max(1,min(workers,len(hosts) or 1))
+        ## @{var} in the command should be evaluated in the caller's frame
+        callerLocals = sys._getframe(1).f_locals
+        callerGlobals = sys._getframe(1).f_globals
+
+        results = []
+        for index,host in enumerate(hosts):
+            results.append(ParallelResult(index,host.get('host') if isinstance(host,dict) else host))
+        ## index => subsession, to be closed when timeout
+        runningSessions = {}
+
+        def task(result,host):
+            result.started = time.time()
+            subsession = None
+            try:
+                if isinstance(host,dict):
+                    args = dict(username=username,password=password,port=port,**kw)
+                    args.update(host)
+                    subsession = self.connect(**args)
+                else:
+                    subsession = self.connect(host,username,password,port,**kw)
+                runningSessions[result.index] = subsession
+                if callable(command):
+                    result.value = subsession.bind(command)(subsession)
+                    if subsession._lastDollar is not None:
+                        result.stdout,result.stderr,result.exitcode = subsession.stdout,subsession.stderr,subsession.exitcode
+                else:
+                    result.stdout,result.stderr,result.exitcode = subsession.execDollar(command,shell,callerLocals,callerGlobals)
+            except Exception as e:
+                if result.error is None: result.error = e
+                if isinstance(e,SSHScriptError): result.exitcode = e.code
+                logDebug(f'{self} parallel() {result.host} failed: {e}')
+            finally:
+                runningSessions.pop(result.index,None)
+                if subsession is not None: subsession.close()
+                ## keep the elapsed time of timeout
+                if result.elapsed is None: result.elapsed = time.time() - result.started
+            return result
+
+        def iterate():
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,thread_name_prefix=f'sshscript-parallel@{self.host}')
+            futures = {}
+            for result,host in zip(results,hosts):
+                futures[executor.submit(task,result,host)] = result
+            pending = set(futures)
+            ## results of timeout hosts which have been yielded, but their thread is still running
+            reported = set()
+            stopping = False
+            try:
+                while pending:
+                    wait = None
+                    if timeout:
+                        startedTimes = [futures[f].started for f in pending if futures[f].started and futures[f] not in reported]
+                        if startedTimes: wait = max(0,min(startedTimes) + timeout - time.time())
+                        ## some hosts are not started yet, check again soon
+                        if len(startedTimes) < len(pending): wait = min(wait if wait is not None else 0.1, 0.1)
+                    done, pending = concurrent.futures.wait(pending,timeout=wait,return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        result = futures[future]
+                        if result in reported: continue
+                        if future.cancelled():
+                            result.error = concurrent.futures.CancelledError(f'{result.host} was not started due to failfast')
+                        if failfast and not result.ok and not stopping:
+                            stopping = True
+                            for f in pending: f.cancel()
+                        yield result
+                    if timeout:
+                        now = time.time()
+                        for future in pending:
+                            result = futures[future]
+                            if result in reported or result.started is None or now - result.started < timeout: continue
+                            result.error = TimeoutError(f'{result.host} runs over {timeout} seconds')
+                            result.elapsed = now - result.started
+                            reported.add(result)
+                            ## close the connection to unblock the thread
+                            subsession = runningSessions.get(result.index)
+                            if subsession is not None: subsession.close()
+                            if failfast and not stopping:
+                                stopping = True
+                                for f in pending: f.cancel()
+                            yield result
+                        ## don't wait for threads of timeout hosts
+                        pending = set(f for f in pending if futures[f] not in reported)
+            finally:
+                ## when the iterator is not consumed completely, don't start the remaining hosts
+                for future in pending: future.cancel()
+                executor.shutdown(wait=False)
+
+        if stream:
+            return iterate()
+        else:
+            for _ in iterate(): pass
+            return results
+    ## alias
+    map = parallel
+
     ## alias of connect, would be removed later
     @export2Dollar
     def open(self,*args,**kw):
@@ -509,6 +744,55 @@ class SSHScriptSession(object):
         if yes is None: return self._careful
         else: self._careful = True if yes else False
 
+    ## v2.0.3, opt-in, lines of a one-dollar on a remote host are executed by a single exec_command()
+    ## instead of one exec_command() for every line. Every line still runs in a subshell,
+    ## its output and exitcode are available by $.results, careful() stops at the failed line.
+    ## The remote shell should be a POSIX shell. (or set os.environ['SSHSCRIPT_BATCH']='1')
+    @export2Dollar
+    def batch(self,yes=None):
+        if yes is None: return self._batch
+        else: self._batch = True if yes else False
+
+    ## v2.0.3, opt-in, local one-dollar commands are executed by persistent shells instead of
+    ## starting a process for every command. Shell builtins then run without forking.
+    ## (or set os.environ['SSHSCRIPT_LOCAL_WORKER']='1', see sshscriptworker)
+    @export2Dollar
+    def localworker(self,yes=None):
+        if yes is None: return self._localWorker
+        else: self._localWorker = True if yes else False
+
+    ## v2.0.3, opt-in, remote one-dollar commands are sent to a helper agent over a long-lived channel
+    ## instead of opening a channel for every command. python3 is required on the remote host.
+    ## (or set os.environ['SSHSCRIPT_AGENT']='1', see sshscriptagent)
+    @export2Dollar
+    def agent(self,yes=None):
+        if yes is None: return self._useAgent
+        else: self._useAgent = True if yes else False
+
+    def getAgent(self):
+        ## the agent is started once per connection
+        if not self.host: raise SSHScriptError('agent requires a connection')
+        ## locked, otherwise concurrent callers would start an agent each
+        with self._agentLock:
+            if self._agent is None or not self._agent.alive():
+                self._agent = sshscriptagent.RemoteAgent(self.scheduler,float(os.environ.get('SSH_CMD_TIMEOUT',os.environ.get('CMD_TIMEOUT',60))))
+            return self._agent
+
+    def dropAgent(self,agent):
+        ## closes the agent (eg. it is stuck in a timed-out command), the next getAgent() starts a new one
+        if self._agent is agent:
+            self._agent = None
+        agent.close()
+
+    ## v2.0.3, submit a command to the helper agent without waiting for its result, eg.
+    ##    requests = [$.submit(f'gzip {x}',cwd='/var/log') for x in files]
+    ##    for request in requests:
+    ##        stdout, stderr, exitcode = request.result()
+    ##        print(request.elapsed)
+    @export2Dollar
+    def submit(self,command,env=None,cwd=None,stdin=None):
+        return self.getAgent().submit(command,env=env,cwd=cwd,stdin=stdin)
+
     @export2Dollar
     def pkey(self,pathOfRsaPrivate):
         if self.client:
@@ -526,9 +810,14 @@ class SSHScriptSession(object):
                 return paramiko.RSAKey.from_private_key(fd)
 
     @export2Dollar
-    def upload(self,src,dst,makedirs=False,overwrite=True):
+    def upload(self,src,dst,makedirs=False,overwrite=True,skip_unchanged=False,
+            blocksize=None,requests=None,window=None,packet=None,callback=None):
         """
         if dst is in an non-existing directory, FileNotFoundError will be raised.
+        v2.0.3 skip_unchanged: if True, the uploading is skipped when dst has the same sha256 (see sshscriptchecksum)
+        v2.0.3 blocksize: bytes of a write request, requests: max outstanding requests,
+            window, packet: window size and max packet size of the SFTP channel (see sshscripttransfer),
+            callback: called with (bytes transferred so far, total bytes). Stats are in $.transferstats.
         """        
         assert self.connected, f'{self} is not connected, client={self.client}'
 
@@ -632,12 +921,30 @@ class SSHScriptSession(object):
                         if not overwrite:
                             raise FileExistsError(f'{dst} already exists')
         
-        self.sftp.put(src,dst)
+        ## v2.0.3
+        if skip_unchanged and sshscriptchecksum.unchangedUpload(self,src,dst):
+            logDebug(f'upload {src} is skipped, {dst} is unchanged')
+            self._transferStats = None
+            return (src,dst)
+
+        sftp = self.transferringSFTP(window,packet)
+        try:
+            attr, self._transferStats = sshscripttransfer.putFile(sftp,src,dst,blocksize,requests,callback)
+        finally:
+            if sftp is not self._sftp: sshscripttransfer.closeSFTP(self.scheduler,sftp)
+        logDebug(f'uploaded {self._transferStats}')
+
+        if skip_unchanged:
+            sshscriptchecksum.uploaded(self,src,dst,attr)
         
         return (src,dst)
 
     @export2Dollar
-    def download(self,src,dst=None):
+    def download(self,src,dst=None,skip_unchanged=False,
+            blocksize=None,requests=None,prefetch=True,window=None,packet=None,callback=None):
+        ## v2.0.3 skip_unchanged: if True, the downloading is skipped when dst has the same sha256 (see sshscriptchecksum)
+        ## v2.0.3 blocksize: bytes of a read request, requests: max outstanding requests of prefetching,
+        ##     prefetch: if False, read requests are sent one by one. See upload() for others.
         if dst is None:
             dst = os.getcwd()
 
@@ -655,13 +962,86 @@ class SSHScriptSession(object):
         if os.path.isdir(dst):
             dst = os.path.join(dst,os.path.basename(src))
 
+        ## v2.0.3
+        if skip_unchanged:
+            if sshscriptchecksum.unchangedDownload(self,src,dst):
+                logDebug(f'download {src} is skipped, {dst} is unchanged')
+                self._transferStats = None
+                return (src,dst)
+            attr = self.sftp.stat(src)
+
         logDebug(f'downaloading from {src} to {dst}')            
         
-        self.sftp.get(src,dst)
+        sftp = self.transferringSFTP(window,packet)
+        try:
+            self._transferStats = sshscripttransfer.getFile(sftp,src,dst,blocksize,requests,prefetch,callback)
+        finally:
+            if sftp is not self._sftp: sshscripttransfer.closeSFTP(self.scheduler,sftp)
+
+        if skip_unchanged:
+            sshscriptchecksum.downloaded(self,src,dst,attr)
         
         logDebug8(f'downaloaded from {src} to {dst}')            
         return (src,dst)
 
+    ## v2.0.3
+    @export2Dollar
+    def upload_tree(self,src,dst,workers=None,progress=None):
+        """
+        upload files of the local directory src into the remote directory dst recursively,
+        over "workers" SFTP channels (default to os.environ['SSHSCRIPT_SFTP_CHANNELS'] or 4).
+        :progress: called with (files done, total files, bytes done, total bytes) after every file
+        returns a list of (src, dst) of uploaded files, failed files are in its "failed" attribute
+        """
+        assert self.connected, f'{self} is not connected, client={self.client}'
+        return sshscripttransfer.uploadTree(self,src,dst,workers,progress)
+
+    ## v2.0.3
+    @export2Dollar
+    def download_tree(self,src,dst=None,workers=None,progress=None):
+        """
+        download files of the remote directory src into the local directory dst recursively,
+        dst is default to the current directory. See upload_tree().
+        """
+        assert self.connected, f'{self} is not connected, client={self.client}'
+        return sshscripttransfer.downloadTree(self,src,dst or os.getcwd(),workers,progress)
+
+    ## v2.0.3
+    @export2Dollar
+    def upload_tar(self,src,dst,compress=None,level=None,include=None,exclude=None,timeout=None):
+        """
+        upload the local directory src into the remote directory dst by streaming a tar archive
+        into "tar -x" on the remote host. It is much faster than upload_tree() for many small files.
+        :compress: None, "gzip" or "zstd", with compression level "level"
+        :include, exclude: glob pattern or list of them, matched against relative paths and basenames
+        :timeout: max seconds of no progress, default to os.environ['SSH_CMD_TIMEOUT']
+        returns a list of (src, dst) of uploaded files, like upload_tree()
+        """
+        assert self.connected, f'{self} is not connected, client={self.client}'
+        return sshscripttransfer.uploadTar(self,src,dst,compress,level,include,exclude,timeout)
+
+    ## v2.0.3
+    @export2Dollar
+    def download_tar(self,src,dst=None,compress=None,level=None,include=None,exclude=None,timeout=None):
+        """
+        download the remote directory src into the local directory dst by "tar -c" on the
+        remote host. dst is default to the current directory. See upload_tar().
+        """
+        assert self.connected, f'{self} is not connected, client={self.client}'
+        return sshscripttransfer.downloadTar(self,src,dst or os.getcwd(),compress,level,include,exclude,timeout)
+
+    ## v2.0.3
+    @export2Dollar
+    def upload_delta(self,src,dst,blocksize=None,timeout=None):
+        """
+        upload a file by sending only blocks which are not in the remote copy of dst (rsync-style),
+        python3 is required on the remote host. If dst is a directory, the file is uploaded into it.
+        :blocksize: default to about the square root of the file size
+        returns a list of one (src, dst), its "transferred" attribute is the bytes over the connection
+        """
+        assert self.connected, f'{self} is not connected, client={self.client}'
+        return sshscripttransfer.uploadDelta(self,src,dst,blocksize,timeout)
+
     def getSocketWithProxyCommand(self,argsOfProxyCommand):
         return paramiko.ProxyCommand(argsOfProxyCommand)        
 
@@ -669,8 +1049,9 @@ class SSHScriptSession(object):
         ## strip off terminal control characters
         return GenericChannel.terminalControlCodePattern.sub('',text)
 
-    ## v2.0
-    def parseScript(self,spyscript,_locals=None):
+    ## v2.0.3, separated from parseScript() for the content of included files to be a part of the cache key
+    def expandInclude(self,spyscript,_locals=None):
+        if not pAtInclude.search(spyscript): return spyscript
         scriptPath = _locals.get('__file__') if _locals else __file__
         def pAtIncludeSub(m):
             prefix, path = m.groups()
@@ -678,8 +1059,12 @@ class SSHScriptSession(object):
             content = SSHScriptSession.include(prefix,abspath)
             return content
         ## expend $.include()
-        spyscript = pAtInclude.sub(pAtIncludeSub,spyscript)
-        
+        return pAtInclude.sub(pAtIncludeSub,spyscript)
+
+    ## v2.0
+    def parseScript(self,spyscript,_locals=None,expanded=False):
+        ## expanded: v2.0.3, $.include() has been expanded by expandInclude(), it should be expanded only once
+        if not expanded: spyscript = self.expandInclude(spyscript,_locals)
         pyscript = sshscriptparser.convert(spyscript)
         return [pyscript]
  
@@ -725,19 +1110,43 @@ class SSHScriptSession(object):
             except KeyError:
                 exec_globals['__name__'] = '__sshscript__'
             
-            ## v2.0 auto detecting script types
-            ## noparse: if True, do not parse the script, it might already converted
-            try:
-                ast.parse(script)
-            except SyntaxError:
-                logDebug(f'{self} run() starts with .spy script')
-                rows = self.parseScript(script,_locals=varLocals)
-                scriptChunk = os.linesep.join(rows)
+            ## v2.0.3 on-disk cache of converted .spy file (see sshscriptcache.py)
+            scriptPath = varLocals.get('__file__') if varLocals else None
+            code = None
+            ## $.include() is expanded once, the digest covers the contents of included files
+            expanded = False
+            if sshscriptcache.cacheable(scriptPath):
+                script = self.expandInclude(script,_locals=varLocals)
+                expanded = True
+                digest = sshscriptcache.digestOf(script)
+                cached = sshscriptcache.load(scriptPath,digest)
             else:
-                ## saved content of --script output
-                logDebug(f'{self} run() starts with regular python script')
-                noparse = True
-                scriptChunk = script
+                digest = cached = None
+            
+            if cached:
+                logDebug(f'{self} run() starts with cached script of {scriptPath}')
+                scriptChunk, code = cached
+            else:
+                ## v2.0 auto detecting script types
+                ## noparse: if True, do not parse the script, it might already converted
+                try:
+                    ast.parse(script)
+                except SyntaxError:
+                    logDebug(f'{self} run() starts with .spy script')
+                    rows = self.parseScript(script,_locals=varLocals,expanded=expanded)
+                    scriptChunk = os.linesep.join(rows)
+                else:
+                    ## saved content of --script output
+                    logDebug(f'{self} run() starts with regular python script')
+                    noparse = True
+                    scriptChunk = script
+                try:
+                    code = compile(scriptChunk,'<string>','exec')
+                except SyntaxError:
+                    ## leave it to sandbox() to show the error lines
+                    code = None
+                else:
+                    if digest: sshscriptcache.save(scriptPath,digest,scriptChunk,code)
             
             if showScript:
                 if os.environ.get('DEBUG'):
@@ -751,7 +1160,7 @@ class SSHScriptSession(object):
                 return {}
             
             ## from v1.1.18, limit the execution scope to a sub-routine
-            def sandbox(scriptChunk,exec_globals,exec_locals):
+            def sandbox(scriptChunk,code,exec_globals,exec_locals):
                 try:                   
                     self.runningScript = scriptChunk
                     ## this is funny, but it works, see the reason of "exec" below 
@@ -772,7 +1181,8 @@ class SSHScriptSession(object):
                     ##       it results more questions than it solves.
                     ##       so, we directly return _globals
                     ##       (2023/8/25, v2.0)
-                    exec(scriptChunk,_globals)
+                    ## v2.0.3, code is None only when scriptChunk has syntax error
+                    exec(scriptChunk if code is None else code,_globals)
                     return _globals
                 except SSHScriptBreak:
                     return _globals
@@ -816,7 +1226,7 @@ class SSHScriptSession(object):
                             start += 1
                     logDebug(f"lineno={lineno},etype={etype}")
                     raise
-            return sandbox(scriptChunk,exec_globals,exce_locals)
+            return sandbox(scriptChunk,code,exec_globals,exce_locals)
 
         ## v.1.18
         self.runLocker.acquire(timeout=60)
@@ -901,7 +1311,28 @@ class SSHScriptSession(object):
         if self._sftp:
             self._sftp.close()
             self._sftp = None
+
+        if self._agent:
+            self._agent.close()
+            self._agent = None
+
+        if self._scheduler:
+            ## overflow clients are closed by the last session sharing the scheduler
+            self._scheduler.detach(self._connectAnother)
+            self._scheduler = None
+        self._connectAnother = None
     
+        ## v2.0.3, return the client to the pool instead of closing it
+        if self._client and self._poolKey is not None:
+            poolKey, self._poolKey = self._poolKey, None
+            ## detach keepalive's callback from this session, the pool would check its health by itself
+            transport = self._client.get_transport()
+            if transport: transport.set_keepalive(int(os.environ.get('SSHSCRIPT_KEEPALIVE_INTERVAL','60')),lambda e: None)
+            if sshscriptpool.getPool().checkin(poolKey,self._client,self._sock):
+                logDebug8(f'{self} returned {self.username}@{self.host}:{self.port} to pool')
+                self._client = None
+                self._sock = None
+
         if self._client:
             self._client.close()
             self._client = None
@@ -919,6 +1350,58 @@ class SSHScriptSession(object):
     ## alias
     disconnect = close    
 
+    ## v2.0.3
+    def execDollar(self,script,isTwodollars,locals,globals):
+        ## Run a $ or $$ command on the calling thread without going through run(),
+        ## which would start a thread, convert the script by sshscriptparser and exec() it.
+        ## @{...} in the script is evaluated against the given locals and globals (the caller's frame).
+        ## It is not serialized by self.runLocker as run() is, so threads (or arun()) may call it concurrently.
+        ## The returned values are those of this call. $.stdout, $.stderr and $.exitcode are of the
+        ## dollar completed last, by whichever thread.
+        if '$.' in script:
+            ## @{$.stdout} is evaluated to _c.stdout, @{$.host} to _sshscript_in_context_.host
+            locals = dict(locals,_c=self._lastDollar,_sshscript_in_context_=self)
+        dollar = SSHScriptDollar(self,script,globals,locals,inWith=False,fr=0)
+        ## SSHScriptDollar.__call__() assigns itself to self._lastDollar
+        dollar(isTwodollars)
+        return dollar.stdout,dollar.stderr,dollar.exitcode
+
+    ## v2.0.3, asyncio front-end (see sshscriptasync)
+    async def aconnect(self,host,username=None,password=None,port=22,policy=None,**kw):
+        ## returns what connect() returns, the connecting runs on the thread pool
+        return await sshscriptasync.runBlocking(self.connect,host,username,password,port,policy,**kw)
+
+    def arun(self,script,locals=None,globals=None,shell=False):
+        ## returns a coroutine of (stdout, stderr, exitcode), eg.
+        ##    stdout, stderr, exitcode = await session.arun('hostname')
+        ##    results = await asyncio.gather(*[session.arun(f'ls @{x}') for x in paths])
+        ## a leading "$$" (or shell=True) runs the script as two-dollars, a leading "$" is optional.
+        ## @{var} is evaluated against the variables of the caller of arun() when the coroutine is created.
+        ## (they are copied here, because the coroutine runs later, eg. after a loop has changed them,
+        ## only names appearing in the script are copied, not the whole namespaces)
+        script = script.strip()
+        if script.startswith('$$'):
+            script, shell = script[2:], True
+        elif script.startswith('$'):
+            script = script[1:]
+        if locals is None: locals = sys._getframe(1).f_locals
+        if globals is None: globals = sys._getframe(1).f_globals
+        names = set(pIdentifier.findall(script))
+        locals = {x:locals[x] for x in names if x in locals}
+        globals = {x:globals[x] for x in names if x in globals}
+        return sshscriptasync.execDollar(self,script,shell,locals,globals)
+
+    def ashell(self,shell=None,locals=None,globals=None):
+        ## for "async with session.ashell() as console:", the console has asendline() and aexpect()
+        if locals is None:
+            locals = sys._getframe(1).f_locals
+        if globals is None:
+            globals = sys._getframe(1).f_globals
+        return sshscriptasync.AsyncShell(self,shell,locals,globals)
+
+    async def aclose(self):
+        return await sshscriptasync.runBlocking(self.close)
+
     ## v2 added feature
     def onedollar(self,script,locals=None,globals=None,timeout=None):
         script = script.strip()
@@ -931,9 +1414,32 @@ class SSHScriptSession(object):
             ## running locals and globals to caller function's locals() and globals() 
             ## reason: @{var} in the script could be evaluated to string, where "var" is global variable in caller
             globals = sys._getframe(1).f_globals
+        if timeout is None:
+            ## v2.0.3, fast path
+            return self.execDollar(script,False,locals,globals)
+        ## run() is still required for timeout
         self.run('$' + script,locals,globals,timeout=timeout)
         return self.stdout,self.stderr,self.exitcode     
     
+    ## v2.0.3
+    @export2Dollar
+    def iterlines(self,script,locals=None,globals=None):
+        ## Iterate lines of stdout of one-dollar command(s) as they arrive, eg.
+        ##    for line in $.iterlines('find / -name "*.log"'):
+        ##        ...
+        ##    print($.exitcode, $.stderr)
+        ## stdout is not kept, so huge outputs are processed with bounded memory.
+        script = script.strip()
+        assert script[0] != '$', '"$" is not required for iterlines()'
+        if locals is None:
+            locals = sys._getframe(1).f_locals
+        if globals is None:
+            globals = sys._getframe(1).f_globals
+        if '$.' in script:
+            locals = dict(locals,_c=self._lastDollar,_sshscript_in_context_=self)
+        dollar = SSHScriptDollar(self,script,globals,locals,inWith=False,fr=0)
+        return dollar.iterLines()
+
     ## v2.0 added feature
     def twodollars(self,script,locals=None,globals=None,timeout=None):
         script = script.strip()
@@ -944,11 +1450,20 @@ class SSHScriptSession(object):
         if globals is None:
             ## running locals and globals to caller function's locals() and globals()
             globals = sys._getframe(1).f_globals
+        if timeout is None:
+            ## v2.0.3, fast path
+            return self.execDollar(script,True,locals,globals)
+        ## run() is still required for timeout
         self.run('$$' + script,locals,globals,timeout=timeout)
         return self.stdout,self.stderr,self.exitcode   
 
     def exec_command(self,*args,**kwargs):
         ## alias for onedollar and twodollars
+        ## v2.0.3, evaluate @{var} against the caller of session(), not this function
+        if len(args) < 2 and kwargs.get('locals') is None:
+            kwargs['locals'] = sys._getframe(1).f_locals
+        if len(args) < 3 and kwargs.get('globals') is None:
+            kwargs['globals'] = sys._getframe(1).f_globals
         if ('shell' in kwargs) and kwargs['shell']:
             del kwargs['shell']
             return self.twodollars(*args,**kwargs)
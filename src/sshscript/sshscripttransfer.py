@@ -0,0 +1,967 @@
+# Copyright (C) 2022-2026  Hsin Yuan Yeh <iapyeh@gmail.com>
+#
+# This file is part of Sshscript.
+#
+# SSHScript is free software; you can redistribute it and/or modify it under the
+# terms of the MIT License.
+#
+# SSHScript is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the MIT License for more details.
+#
+# You should have received a copy of the MIT License along with SSHScript;
+# if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+'''
+Bulk transfers of directory trees (v2.0.3)
+
+$.upload_tree() and $.download_tree() walk a directory and transfer its files
+over a pool of SFTP channels on the same connection, so many files are
+transferred concurrently instead of one "sftp.put" after another. Remote
+directories are created in batches by "mkdir -p" before files are uploaded.
+A failed file does not stop the others, it is reported in result.failed.
+
+    result = $.upload_tree('./release','/opt/app')
+    print(result.files, result.bytes, result.throughput, result.failed)
+    for src, dst in result: ...
+
+For directories full of small files, $.upload_tar() and $.download_tar() stream
+a tar archive into (or out of) "tar" on the remote host over a single exec
+channel instead, optionally compressed by gzip or zstd (zstd requires the
+"zstandard" package locally and the "zstd" command on the remote host).
+There is no per-file round trip at all.
+
+    result = $.upload_tar('./venv','/opt/venv',compress='gzip',exclude=['*.pyc','__pycache__'])
+
+For a large file which changed slightly, $.upload_delta() sends only the changed
+parts, rsync-style. A helper (DELTA_SOURCE, run by python3 on the remote host,
+os.environ['SSHSCRIPT_AGENT_PYTHON'] as the agent) returns checksums of blocks of
+the remote copy, then the local file is scanned for those blocks by a rolling
+checksum, and only a recipe of "copy block n" and literal bytes is sent back.
+The helper rebuilds the file aside, verifies its sha256, then replaces the old one.
+
+    result = $.upload_delta('./seed.db','/var/lib/app/seed.db')
+    print(result.transferred, result.bytes)
+
+Single-file transfers of upload(), download() and the trees are made by putFile()
+and getFile(), which are tunable for high-latency links: the size of a read or
+write request, the number of outstanding requests, and the window and max packet
+size of SFTP channels. Their stats (bytes, seconds, MB/s) are in $.transferstats.
+See sshscriptbenchmark for tuning them against an in-process SFTP server.
+Without a limit, downloads are prefetched by paramiko. With a limit, read requests
+are pipelined by getFile() itself, a new request is sent when a reply has come.
+
+Environment variables:
+    SSHSCRIPT_SFTP_CHANNELS=4       : number of SFTP channels (and threads) for a transfer
+    SSHSCRIPT_SFTP_BLOCKSIZE=32768  : bytes of a read or write request (1KB to 255KB)
+    SSHSCRIPT_SFTP_REQUESTS=0       : max outstanding requests of a file (0 for unlimited, as paramiko does)
+    SSHSCRIPT_SFTP_WINDOW=0         : window size of SFTP channels (0 for the transport's default, 2MB)
+    SSHSCRIPT_SFTP_PACKET=0         : max packet size of SFTP channels (0 for the transport's default, 32KB)
+'''
+import os
+import io
+import stat
+import time
+import gzip
+import json
+import math
+import mmap
+import zlib
+import struct
+import hashlib
+import fnmatch
+import tarfile
+import shlex
+import queue
+import socket
+import selectors
+import threading
+import posixpath
+import collections
+import concurrent.futures
+import paramiko
+try:
+    from .sshscripterror import SSHScriptError, logDebug, logDebug8
+except ImportError:
+    from sshscripterror import SSHScriptError, logDebug, logDebug8
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def channels():
+    return int(os.environ.get('SSHSCRIPT_SFTP_CHANNELS',4))
+
+def transferOptions(blocksize=None,requests=None,window=None,packet=None):
+    ## returns (blocksize, requests, window, packet), None is given for defaults of paramiko
+    def option(value,name,default):
+        if value is None: value = int(os.environ.get(name,default))
+        return value or None
+    blocksize = option(blocksize,'SSHSCRIPT_SFTP_BLOCKSIZE',32768)
+    ## the sftp-server of OpenSSH does not reply more than 255KB for a read request
+    blocksize = max(1024,min(255 * 1024,blocksize or 32768))
+    return (blocksize,option(requests,'SSHSCRIPT_SFTP_REQUESTS',0),
+        option(window,'SSHSCRIPT_SFTP_WINDOW',0),option(packet,'SSHSCRIPT_SFTP_PACKET',0))
+
+def openSFTP(scheduler,window=None,packet=None,timeout=None):
+    ## returns a paramiko.SFTPClient over a session channel opened through the scheduler
+    channel = scheduler.openSession(timeout,windowSize=window,maxPacketSize=packet)
+    try:
+        channel.invoke_subsystem('sftp')
+        return paramiko.SFTPClient(channel)
+    except:
+        channel.close()
+        scheduler.release(channel)
+        raise
+
+def closeSFTP(scheduler,client):
+    ## closes a client of openSFTP() and gives its channel back
+    try:
+        client.close()
+    finally:
+        scheduler.release(client.sock)
+
+def _stats(src,dst,size,start,blocksize,requests):
+    seconds = time.time() - start
+    return {
+        'src':src,
+        'dst':dst,
+        'bytes':size,
+        'seconds':seconds,
+        'MBps':size / seconds / 1048576 if seconds else 0.0,
+        'blocksize':blocksize,
+        'requests':requests,
+    }
+
+def putFile(sftp,src,dst,blocksize=None,requests=None,callback=None):
+    ## like sftp.put(), returns (SFTPAttributes of dst, stats)
+    ## callback: called with (bytes transferred so far, total bytes) as sftp.put()
+    start = time.time()
+    blocksize, requests, _, _ = transferOptions(blocksize,requests)
+    size = os.stat(src).st_size
+    transferred = 0
+    with open(src,'rb') as fl:
+        with sftp.file(dst,'wb',bufsize=blocksize) as fr:
+            ## paramiko splits a write into requests of MAX_REQUEST_SIZE
+            fr.MAX_REQUEST_SIZE = blocksize
+            fr.set_pipelined(True)
+            while True:
+                data = fl.read(blocksize)
+                if not data: break
+                fr.write(data)
+                transferred += len(data)
+                if requests:
+                    ## wait for acknowledgements of the oldest requests
+                    ## (paramiko's private API, as SFTPFile._write() does)
+                    fr.flush()
+                    while len(fr._reqs) > requests:
+                        t, msg = fr.sftp._read_response(fr._reqs.popleft())
+                        if t != paramiko.sftp.CMD_STATUS:
+                            raise paramiko.SFTPError('Expected status')
+                if callback: callback(transferred,size)
+    attr = sftp.stat(dst)
+    if attr.st_size != size:
+        raise IOError(f'size mismatch in put! {attr.st_size} != {size}')
+    return attr, _stats(src,dst,size,start,blocksize,requests)
+
+class _ReadReplies(object):
+    ## collects replies of read requests sent by _readPipelined(), paramiko calls _async_response()
+    ## of the object given to sftp._async_request() when a reply has come
+    def __init__(self):
+        self.replies = {}
+    def _async_response(self,t,msg,num):
+        self.replies[num] = (t,msg)
+
+def _readPipelined(fr,size,blocksize,requests,write):
+    ## reads the file by at most "requests" outstanding read requests, data are given to write() in order.
+    ## fr.prefetch(size,max_concurrent_requests) of paramiko (>= 3.3) polls every 10ms for a free slot,
+    ## here a new request is sent as soon as a reply has come (paramiko's private API, as SFTPFile does)
+    sftp = fr.sftp
+    collector = _ReadReplies()
+    pending = collections.deque()
+    offset = 0
+    while offset < size or pending:
+        while offset < size and len(pending) < requests:
+            length = min(blocksize,size - offset)
+            num = sftp._async_request(collector,paramiko.sftp.CMD_READ,fr.handle,paramiko.sftp.int64(offset),int(length))
+            pending.append((num,offset,length))
+            offset += length
+        num, at, length = pending.popleft()
+        while num not in collector.replies:
+            ## reads one reply, which is given to collector._async_response()
+            sftp._read_response()
+        t, msg = collector.replies.pop(num)
+        if t == paramiko.sftp.CMD_STATUS:
+            ## raises EOFError or IOError
+            sftp._convert_status(msg)
+        if t != paramiko.sftp.CMD_DATA:
+            raise paramiko.SFTPError('Expected data')
+        data = msg.get_string()
+        while len(data) < length:
+            ## the server replied less than requested
+            t, msg = sftp._request(paramiko.sftp.CMD_READ,fr.handle,paramiko.sftp.int64(at + len(data)),int(length - len(data)))
+            if t != paramiko.sftp.CMD_DATA:
+                raise paramiko.SFTPError('Expected data')
+            data += msg.get_string()
+        write(data)
+
+def getFile(sftp,src,dst,blocksize=None,requests=None,prefetch=True,callback=None):
+    ## like sftp.get(), returns stats
+    start = time.time()
+    blocksize, requests, _, _ = transferOptions(blocksize,requests)
+    transferred = 0
+    with sftp.open(src,'rb') as fr:
+        fr.MAX_REQUEST_SIZE = blocksize
+        size = fr.stat().st_size
+        with open(dst,'wb') as fl:
+            def write(data):
+                nonlocal transferred
+                fl.write(data)
+                transferred += len(data)
+                if callback: callback(transferred,size)
+            if prefetch and requests:
+                _readPipelined(fr,size,blocksize,requests,write)
+            else:
+                if prefetch: fr.prefetch(size)
+                while True:
+                    data = fr.read(blocksize)
+                    if not data: break
+                    write(data)
+    if transferred != size:
+        raise IOError(f'size mismatch in get! {transferred} != {size}')
+    return _stats(src,dst,size,start,blocksize,requests)
+
+def commandTimeout():
+    ## max seconds of no progress of a tar stream, as one-dollar's timeout
+    return float(os.environ.get('SSH_CMD_TIMEOUT',os.environ.get('CMD_TIMEOUT',60)))
+
+class TransferResult(list):
+    ## a list of (src, dst) of transferred files, like the returned value of upload() and download()
+    def __init__(self):
+        super().__init__()
+        ## [(src, dst, exception), ...] of failed files
+        self.failed = []
+        self.bytes = 0
+        ## bytes over the connection, differs from self.bytes when compressed
+        self.transferred = 0
+        self.directories = 0
+        ## bytes of files which were not sent but copied from the remote copy (by upload_delta())
+        self.copied = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<TransferResult {self.stats()}>'
+
+    @property
+    def files(self):
+        return len(self)
+
+    @property
+    def throughput(self):
+        ## bytes per second
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def stats(self):
+        return {
+            'files':self.files,
+            'failed':len(self.failed),
+            'directories':self.directories,
+            'bytes':self.bytes,
+            'transferred':self.transferred,
+            'copied':self.copied,
+            'elapsed':self.elapsed,
+            'throughput':self.throughput,
+        }
+
+    def add(self,src,dst,size):
+        with self._lock:
+            self.append((src,dst))
+            self.bytes += size
+
+    def fail(self,src,dst,error):
+        with self._lock:
+            self.failed.append((src,dst,error))
+
+class SFTPPool(object):
+    ## SFTP clients opened through the scheduler of the connection for a transfer,
+    ## they are closed when the transfer has completed to give the channels back
+    def __init__(self,scheduler,maxSize=4):
+        self.scheduler = scheduler
+        self.maxSize = maxSize
+        self._idle = queue.Queue()
+        self._count = 0
+        self._lock = threading.Lock()
+        self._clients = []
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._count < self.maxSize
+            if create: self._count += 1
+        if not create:
+            return self._idle.get()
+        try:
+            _, _, window, packet = transferOptions()
+            client = openSFTP(self.scheduler,window,packet)
+        except:
+            with self._lock:
+                self._count -= 1
+            raise
+        with self._lock:
+            self._clients.append(client)
+        logDebug8(f'[transfer] opened sftp channel #{self._count}')
+        return client
+
+    def release(self,client):
+        if client.sock.closed:
+            ## broken, a new one would be opened
+            with self._lock:
+                self._count -= 1
+                self._clients.remove(client)
+            self.scheduler.release(client.sock)
+        else:
+            self._idle.put(client)
+
+    def close(self):
+        with self._lock:
+            clients = self._clients[:]
+            self._clients.clear()
+            self._count = 0
+        self._idle = queue.Queue()
+        for client in clients:
+            try:
+                closeSFTP(self.scheduler,client)
+            except Exception as e:
+                logDebug(f'[transfer] error on closing {client}:{e}')
+
+def execCommand(scheduler,command,timeout=None):
+    ## runs a command without a pty, returns (exitcode, stdout, stderr) in bytes
+    channel = scheduler.openSession(timeout)
+    stdout, stderr = [], []
+    try:
+        channel.exec_command(command)
+        ## drain stdout and stderr concurrently, as SSHScriptDollar.iterExecCommand() does
+        with selectors.DefaultSelector() as selector:
+            selector.register(channel,selectors.EVENT_READ)
+            while True:
+                received = False
+                if channel.recv_stderr_ready():
+                    stderr.append(channel.recv_stderr(65536))
+                    received = True
+                if channel.recv_ready():
+                    stdout.append(channel.recv(65536))
+                    received = True
+                if received:
+                    continue
+                elif channel.eof_received or channel.closed:
+                    break
+                elif not selector.select(timeout):
+                    raise TimeoutError(f'exec_command:{command}')
+        return channel.recv_exit_status(), b''.join(stdout), b''.join(stderr)
+    finally:
+        channel.close()
+        scheduler.release(channel)
+
+def makeRemoteDirs(pool,scheduler,dirs,timeout=None):
+    ## creates remote directories by "mkdir -p" with many directories a time
+    batch, size = [], 0
+    batches = []
+    for path in dirs:
+        quoted = shlex.quote(path)
+        if size + len(quoted) > 65536 and batch:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(quoted)
+        size += len(quoted) + 1
+    if batch: batches.append(batch)
+    for batch in batches:
+        try:
+            exitcode, _, stderr = execCommand(scheduler,'mkdir -p -- ' + ' '.join(batch),timeout)
+        except paramiko.SSHException as e:
+            ## eg. a server only for sftp
+            exitcode, stderr = None, str(e).encode()
+        if exitcode != 0:
+            logDebug(f'[transfer] mkdir -p failed ({stderr.decode("utf8","replace").strip()}), making directories by sftp')
+            makeRemoteDirsBySFTP(pool,dirs)
+            return
+
+def makeRemoteDirsBySFTP(pool,dirs):
+    client = pool.acquire()
+    try:
+        for path in dirs:
+            try:
+                client.mkdir(path)
+            except IOError:
+                ## exists already
+                pass
+    finally:
+        pool.release(client)
+
+def _transfer(pool,result,tasks,method,progress,workers):
+    ## tasks: [(src, dst, size), ...], method: "put" or "get"
+    total = len(tasks)
+    totalBytes = sum(x[2] for x in tasks)
+    done = [0,0]
+    doneLock = threading.Lock()
+    def run(src,dst,size):
+        try:
+            client = pool.acquire()
+        except Exception as e:
+            result.fail(src,dst,e)
+            return
+        try:
+            if method == 'put':
+                putFile(client,src,dst)
+            else:
+                getFile(client,src,dst)
+        except Exception as e:
+            logDebug(f'[transfer] {method} {src} to {dst} failed: {e}')
+            result.fail(src,dst,e)
+        else:
+            result.add(src,dst,size)
+        finally:
+            pool.release(client)
+        with doneLock:
+            done[0] += 1
+            done[1] += size
+            if progress: progress(done[0],total,done[1],totalBytes)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers,thread_name_prefix='sshscript-transfer') as executor:
+        for future in [executor.submit(run,*task) for task in tasks]:
+            future.result()
+
+def uploadTree(session,src,dst,workers=None,progress=None):
+    ## progress: called with (files done, total files, bytes done, total bytes) after every file
+    start = time.time()
+    workers = workers or channels()
+    src = os.path.abspath(os.path.normpath(src))
+    if not os.path.isdir(src):
+        raise NotADirectoryError(src)
+    dst = dst.replace('\\','/').rstrip('/') or '/'
+    dirs, tasks = [dst], []
+    for root, dirnames, filenames in os.walk(src):
+        relative = os.path.relpath(root,src)
+        remoteRoot = dst if relative == '.' else posixpath.join(dst,*relative.split(os.sep))
+        for name in dirnames:
+            dirs.append(posixpath.join(remoteRoot,name))
+        for name in filenames:
+            path = os.path.join(root,name)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                ## eg. a broken symbolic link
+                continue
+            tasks.append((path,posixpath.join(remoteRoot,name),size))
+    logDebug(f'[transfer] uploading {len(tasks)} files in {len(dirs)} directories from {src} to {dst}')
+    result = TransferResult()
+    pool = SFTPPool(session.scheduler,workers)
+    try:
+        makeRemoteDirs(pool,session.scheduler,dirs)
+        result.directories = len(dirs)
+        _transfer(pool,result,tasks,'put',progress,workers)
+    finally:
+        pool.close()
+    result.elapsed = time.time() - start
+    logDebug(f'[transfer] uploaded {result}')
+    return result
+
+def downloadTree(session,src,dst,workers=None,progress=None):
+    start = time.time()
+    workers = workers or channels()
+    src = src.replace('\\','/').rstrip('/') or '/'
+    dst = os.path.abspath(dst)
+    pool = SFTPPool(session.scheduler,workers)
+    try:
+        result = _downloadTree(pool,src,dst,workers,progress)
+    finally:
+        pool.close()
+    result.elapsed = time.time() - start
+    logDebug(f'[transfer] downloaded {result}')
+    return result
+
+def _downloadTree(pool,src,dst,workers,progress):
+    ## walk the remote tree with concurrent listing of directories
+    dirs, tasks = [dst], []
+    lock = threading.Lock()
+    def listdir(remoteDir,localDir):
+        client = pool.acquire()
+        try:
+            entries = client.listdir_attr(remoteDir)
+        finally:
+            pool.release(client)
+        subdirs = []
+        with lock:
+            for entry in entries:
+                remotePath = posixpath.join(remoteDir,entry.filename)
+                localPath = os.path.join(localDir,entry.filename)
+                if stat.S_ISDIR(entry.st_mode):
+                    dirs.append(localPath)
+                    subdirs.append((remotePath,localPath))
+                elif stat.S_ISREG(entry.st_mode):
+                    tasks.append((remotePath,localPath,entry.st_size))
+        return subdirs
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers,thread_name_prefix='sshscript-transfer') as executor:
+        pending = {executor.submit(listdir,src,dst)}
+        while pending:
+            completed, pending = concurrent.futures.wait(pending,return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in completed:
+                for subdir in future.result():
+                    pending.add(executor.submit(listdir,*subdir))
+    logDebug(f'[transfer] downloading {len(tasks)} files in {len(dirs)} directories from {src} to {dst}')
+    for path in dirs:
+        os.makedirs(path,exist_ok=True)
+    result = TransferResult()
+    result.directories = len(dirs)
+    _transfer(pool,result,tasks,'get',progress,workers)
+    return result
+
+class PathFilter(object):
+    ## include and exclude are glob patterns (or a list of them), matched against
+    ## the relative path and the basename, eg. "*.pyc", "build/*", "__pycache__"
+    def __init__(self,include=None,exclude=None):
+        self.include = [include] if isinstance(include,str) else list(include or [])
+        self.exclude = [exclude] if isinstance(exclude,str) else list(exclude or [])
+
+    def _match(self,path,patterns):
+        name = posixpath.basename(path)
+        return any(fnmatch.fnmatch(path,x) or fnmatch.fnmatch(name,x) for x in patterns)
+
+    def excluded(self,path):
+        ## files in an excluded directory are excluded too
+        parts = path.split('/')
+        return any(self._match('/'.join(parts[:i]),self.exclude) for i in range(1,len(parts)+1))
+
+    def accepted(self,path):
+        ## for files
+        if self.excluded(path): return False
+        return (not self.include) or self._match(path,self.include)
+
+def _compression(compress,level):
+    ## returns (remote command to decompress, remote command to compress, level)
+    if compress in (None,False,''):
+        return None, None, None
+    elif compress in ('gzip','gz'):
+        level = 6 if level is None else level
+        return 'gzip -dc', f'gzip -{level}', level
+    elif compress in ('zstd','zst'):
+        if zstandard is None:
+            raise SSHScriptError('compress="zstd" requires the zstandard package',503)
+        level = 3 if level is None else level
+        return 'zstd -dcq', f'zstd -q -{min(19,max(1,level))}', level
+    raise ValueError(f'unknown compress {compress}, should be "gzip" or "zstd"')
+
+class _ChannelWriter(io.RawIOBase):
+    ## a writable file object sending data to a paramiko channel
+    def __init__(self,channel):
+        self.channel = channel
+        self.sent = 0
+    def writable(self):
+        return True
+    def write(self,data):
+        self.channel.sendall(data)
+        self.sent += len(data)
+        return len(data)
+
+class _ChannelReader(io.RawIOBase):
+    ## a readable file object of stdout of a paramiko channel
+    def __init__(self,channel):
+        self.channel = channel
+        self.received = 0
+    def readable(self):
+        return True
+    def readinto(self,buffer):
+        data = self.channel.recv(len(buffer))
+        buffer[:len(data)] = data
+        self.received += len(data)
+        return len(data)
+
+class _Drainer(object):
+    ## reads stderr (and stdout if discarding) of a channel in threads while a stream is being sent to it,
+    ## otherwise outputs of the remote command (eg. warnings of tar) fill the window of the channel and it stalls
+    maxSize = 65536
+    def __init__(self,channel,stdout=False):
+        self.channel = channel
+        ## the last self.maxSize bytes of stderr
+        self.stderr = bytearray()
+        self._threads = [threading.Thread(target=self._run,args=(channel.recv_stderr,self.stderr),daemon=True)]
+        if stdout:
+            self._threads.append(threading.Thread(target=self._run,args=(channel.recv,None),daemon=True))
+        for thread in self._threads:
+            thread.start()
+    def _run(self,recv,buffer):
+        while True:
+            try:
+                data = recv(65536)
+            except socket.timeout:
+                ## nothing was received in the channel's timeout
+                if self.channel.closed: break
+                continue
+            except OSError:
+                break
+            if not data: break
+            if buffer is not None:
+                buffer += data
+                if len(buffer) > self.maxSize: del buffer[:-self.maxSize]
+    def join(self,timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+def _finishCommand(channel,command,timeout,drainer=None):
+    ## returns the exitcode, raises SSHScriptError with stderr when it failed
+    ## drainer: a _Drainer of the channel, which has been reading stderr
+    if not channel.status_event.wait(timeout):
+        raise TimeoutError(f'exec_command:{command}')
+    exitcode = channel.recv_exit_status()
+    if exitcode != 0:
+        if drainer:
+            ## stderr is complete when the remote has sent EOF
+            drainer.join(timeout)
+            stderr = bytes(drainer.stderr)
+        else:
+            stderr = b''
+            while channel.recv_stderr_ready():
+                stderr += channel.recv_stderr(65536)
+        raise SSHScriptError(f'{command} failed:{stderr.decode("utf8","replace").strip()}',exitcode)
+    return exitcode
+
+def _writeTar(writer,src,dst,compress,level,pathFilter,result):
+    if compress in ('gzip','gz'):
+        sink = gzip.GzipFile(fileobj=writer,mode='wb',compresslevel=level)
+    elif compress in ('zstd','zst'):
+        sink = zstandard.ZstdCompressor(level=level).stream_writer(writer,closefd=False)
+    else:
+        sink = writer
+    with tarfile.open(fileobj=sink,mode='w|',format=tarfile.PAX_FORMAT) as tar:
+        for root, dirnames, filenames in os.walk(src):
+            relative = os.path.relpath(root,src)
+            relative = '' if relative == '.' else relative.replace(os.sep,'/')
+            ## prune excluded directories
+            dirnames[:] = [x for x in dirnames if not pathFilter.excluded(posixpath.join(relative,x))]
+            for name in dirnames:
+                tar.add(os.path.join(root,name),posixpath.join(relative,name),recursive=False)
+                result.directories += 1
+            for name in filenames:
+                arcname = posixpath.join(relative,name)
+                if not pathFilter.accepted(arcname): continue
+                path = os.path.join(root,name)
+                try:
+                    info = tar.gettarinfo(path,arcname)
+                    if info.isreg():
+                        with open(path,'rb') as fd:
+                            tar.addfile(info,fd)
+                        result.add(path,posixpath.join(dst,arcname),info.size)
+                    else:
+                        tar.addfile(info)
+                except OSError as e:
+                    ## eg. removed while walking or no permission
+                    logDebug(f'[transfer] {path} is skipped: {e}')
+                    result.fail(path,posixpath.join(dst,arcname),e)
+    if sink is not writer: sink.close()
+
+def uploadTar(session,src,dst,compress=None,level=None,include=None,exclude=None,timeout=None):
+    ## streams a tar archive of the local directory src into "tar -x" in the remote directory dst
+    start = time.time()
+    timeout = timeout or commandTimeout()
+    src = os.path.abspath(os.path.normpath(src))
+    if not os.path.isdir(src):
+        raise NotADirectoryError(src)
+    dst = dst.replace('\\','/').rstrip('/') or '/'
+    decompressor, _, level = _compression(compress,level)
+    pathFilter = PathFilter(include,exclude)
+    command = f'mkdir -p -- {shlex.quote(dst)} && cd -- {shlex.quote(dst)} && '
+    command += (f'{decompressor} | tar -xf - --no-same-owner' if decompressor else 'tar -xf - --no-same-owner')
+    logDebug(f'[transfer] uploading {src} to {dst} by tar stream:{command}')
+    result = TransferResult()
+    scheduler = session.scheduler
+    channel = scheduler.openSession(timeout)
+    try:
+        channel.settimeout(timeout)
+        channel.exec_command(command)
+        writer = _ChannelWriter(channel)
+        drainer = _Drainer(channel,stdout=True)
+        try:
+            _writeTar(writer,src,dst,compress,level,pathFilter,result)
+            channel.shutdown_write()
+        except OSError as e:
+            ## the remote command has exited (eg. no permission), report it by its stderr
+            logDebug(f'[transfer] streaming failed: {e}')
+            _finishCommand(channel,command,timeout,drainer)
+            raise
+        _finishCommand(channel,command,timeout,drainer)
+    finally:
+        channel.close()
+        scheduler.release(channel)
+    result.transferred = writer.sent
+    result.elapsed = time.time() - start
+    logDebug(f'[transfer] uploaded {result}')
+    return result
+
+def downloadTar(session,src,dst,compress=None,level=None,include=None,exclude=None,timeout=None):
+    ## streams a tar archive of the remote directory src by "tar -c" and extracts it into the local directory dst
+    start = time.time()
+    timeout = timeout or commandTimeout()
+    src = src.replace('\\','/').rstrip('/') or '/'
+    dst = os.path.abspath(dst)
+    _, compressor, level = _compression(compress,level)
+    pathFilter = PathFilter(include,exclude)
+    ## excluded files are not sent, included files are selected when extracting
+    excludes = ''.join(f' --exclude={shlex.quote(x)}' for x in pathFilter.exclude)
+    command = f'cd -- {shlex.quote(src)} && tar -cf -{excludes} .'
+    if compressor: command += f' | {compressor}'
+    logDebug(f'[transfer] downloading {src} to {dst} by tar stream:{command}')
+    os.makedirs(dst,exist_ok=True)
+    result = TransferResult()
+    scheduler = session.scheduler
+    channel = scheduler.openSession(timeout)
+    try:
+        channel.settimeout(timeout)
+        channel.exec_command(command)
+        reader = _ChannelReader(channel)
+        drainer = _Drainer(channel)
+        try:
+            if compress in ('gzip','gz'):
+                source = gzip.GzipFile(fileobj=io.BufferedReader(reader,65536),mode='rb')
+            elif compress in ('zstd','zst'):
+                source = zstandard.ZstdDecompressor().stream_reader(reader,closefd=False)
+            else:
+                source = io.BufferedReader(reader,65536)
+            extractFilter = getattr(tarfile,'data_filter',None)
+            with tarfile.open(fileobj=source,mode='r|') as tar:
+                for member in tar:
+                    name = member.name[2:] if member.name.startswith('./') else member.name
+                    if not name or name == '.': continue
+                    if member.isdir():
+                        if pathFilter.excluded(name): continue
+                    elif not pathFilter.accepted(name):
+                        continue
+                    if extractFilter is None and (name.startswith('/') or '..' in name.split('/')):
+                        ## python without tarfile.data_filter (< 3.11.4)
+                        result.fail(posixpath.join(src,name),os.path.join(dst,name),SSHScriptError(f'unsafe path {name}'))
+                        continue
+                    member.name = name
+                    try:
+                        if extractFilter:
+                            tar.extract(member,dst,filter='data')
+                        else:
+                            tar.extract(member,dst)
+                    except (OSError,tarfile.TarError) as e:
+                        logDebug(f'[transfer] {name} is not extracted: {e}')
+                        result.fail(posixpath.join(src,name),os.path.join(dst,name),e)
+                        continue
+                    if member.isdir():
+                        result.directories += 1
+                    elif member.isreg():
+                        result.add(posixpath.join(src,name),os.path.join(dst,*name.split('/')),member.size)
+        except (OSError,EOFError,tarfile.TarError) as e:
+            ## the remote command has failed (eg. no such directory), report it by its stderr
+            logDebug(f'[transfer] streaming failed: {e}')
+            _finishCommand(channel,command,timeout,drainer)
+            raise
+        _finishCommand(channel,command,timeout,drainer)
+    finally:
+        channel.close()
+        scheduler.release(channel)
+    result.transferred = reader.received
+    result.elapsed = time.time() - start
+    logDebug(f'[transfer] downloaded {result}')
+    return result
+
+## runs on the remote host by "python3 -c", it should work with python3 standard library only.
+## argv: path, basename (used when path is a directory), block size
+DELTA_SOURCE = r"""
+import os, sys, json, struct, zlib, hashlib
+path, name, size = sys.argv[1], sys.argv[2], int(sys.argv[3])
+rfile = sys.stdin.buffer
+wfile = sys.stdout.buffer
+if os.path.isdir(path): path = os.path.join(path, name)
+try:
+    old = open(path, 'rb')
+except FileNotFoundError:
+    old = None
+sums = []
+if old:
+    while True:
+        block = old.read(size)
+        if len(block) < size: break
+        sums.append(struct.pack('>I', zlib.adler32(block)) + hashlib.blake2b(block, digest_size=16).digest())
+header = json.dumps({'path': path, 'blocks': len(sums)}).encode()
+wfile.write(struct.pack('>I', len(header)) + header + b''.join(sums))
+wfile.flush()
+def readexact(n):
+    buf = b''
+    while len(buf) < n:
+        chunk = rfile.read(n - len(buf))
+        if not chunk: raise EOFError('recipe is incomplete')
+        buf += chunk
+    return buf
+tmp = '%s.sshscript-delta-%d' % (path, os.getpid())
+out = open(tmp, 'wb')
+digest = hashlib.sha256()
+try:
+    while True:
+        op = readexact(1)
+        if op == b'C':
+            index, count = struct.unpack('>II', readexact(8))
+            old.seek(index * size)
+            data = old.read(count * size)
+        elif op == b'L':
+            data = readexact(struct.unpack('>I', readexact(4))[0])
+        elif op == b'E':
+            expected = readexact(32)
+            break
+        else:
+            raise ValueError('unknown op %r' % op)
+        out.write(data)
+        digest.update(data)
+    out.close()
+    if digest.digest() != expected: raise ValueError('sha256 mismatched')
+    if old: os.chmod(tmp, os.fstat(old.fileno()).st_mode & 0o7777)
+    os.replace(tmp, path)
+except BaseException:
+    out.close()
+    os.remove(tmp)
+    raise
+wfile.write(json.dumps({'path': path, 'sha256': digest.hexdigest()}).encode())
+wfile.flush()
+"""
+
+def blockSize(size):
+    ## about sqrt(size) as rsync, 1KB to 128KB
+    return max(1024,min(1 << 17,int(math.sqrt(size)) // 1024 * 1024))
+
+def deltaRecipe(data,size,sums):
+    ## yields ops rebuilding data from blocks of the remote copy.
+    ## ("C", index, count) copies count blocks from the index-th block, ("L", bytes) are literal bytes.
+    ## sums: {adler32: {blake2b: index}} of full blocks of the remote copy.
+    length = len(data)
+    pos = literalStart = 0
+    lastCopy = None
+    ## after many consecutive blocks without a match (eg. rewritten region), the byte-by-byte
+    ## rolling search is only made over every 16th block to bound the cost. A rolling search over
+    ## one block covers every alignment, so the blocks after an insertion of any length are found
+    ## again, at most 16 blocks after its end.
+    misses = 0
+    def find(start,weak):
+        strongs = sums.get(weak)
+        if strongs:
+            return strongs.get(hashlib.blake2b(data[start:start+size],digest_size=16).digest())
+    def literal(start,end):
+        for x in range(start,end,1 << 20):
+            yield ('L',data[x:min(end,x + (1 << 20))])
+    while pos + size <= length:
+        weak = zlib.adler32(data[pos:pos+size])
+        index = find(pos,weak)
+        found = pos
+        if index is None and (misses < 16 or misses % 16 == 0):
+            ## rolling adler32 over the next block
+            a, b = weak & 0xffff, weak >> 16
+            end = min(length - size,pos + size)
+            q = pos
+            while q < end:
+                out, into = data[q], data[q + size]
+                a = (a - out + into) % 65521
+                b = (b - size * out + a - 1) % 65521
+                q += 1
+                if ((b << 16) | a) in sums:
+                    index = find(q,(b << 16) | a)
+                    if index is not None:
+                        found = q
+                        break
+            else:
+                pos = max(end,pos + 1)
+        elif index is None:
+            pos += size
+        if index is None:
+            misses += 1
+            continue
+        misses = 0
+        if found > literalStart:
+            if lastCopy: yield lastCopy
+            lastCopy = None
+            yield from literal(literalStart,found)
+        if lastCopy and lastCopy[1] + lastCopy[2] == index:
+            lastCopy = ('C',lastCopy[1],lastCopy[2] + 1)
+        else:
+            if lastCopy: yield lastCopy
+            lastCopy = ('C',index,1)
+        pos = literalStart = found + size
+    if lastCopy: yield lastCopy
+    yield from literal(literalStart,length)
+
+def uploadDelta(session,src,dst,blocksize=None,timeout=None):
+    ## returns a TransferResult of one (src, dst), "transferred" is the bytes sent and received
+    start = time.time()
+    timeout = timeout or commandTimeout()
+    src = os.path.abspath(os.path.normpath(src))
+    if not os.path.isfile(src):
+        raise SSHScriptError(f'uploading src "{src}" must be a file',503)
+    dst = dst.replace('\\','/')
+    if dst.endswith('/'): dst += os.path.basename(src)
+    length = os.path.getsize(src)
+    size = blocksize or blockSize(length)
+    python = os.environ.get('SSHSCRIPT_AGENT_PYTHON','python3')
+    source = DELTA_SOURCE.encode('utf8')
+    command = f"{python} -c 'import sys;exec(sys.stdin.buffer.read({len(source)}))' {shlex.quote(dst)} {shlex.quote(os.path.basename(src))} {size}"
+    logDebug(f'[transfer] delta uploading {src} to {dst}, block size={size}')
+    result = TransferResult()
+    scheduler = session.scheduler
+    channel = scheduler.openSession(timeout)
+    try:
+        channel.settimeout(timeout)
+        channel.exec_command(command)
+        rfile = channel.makefile('rb')
+        writer = _ChannelWriter(channel)
+        drainer = _Drainer(channel)
+        try:
+            writer.write(source)
+            head = rfile.read(4)
+            if len(head) < 4: raise EOFError('delta helper exited')
+            header = rfile.read(struct.unpack('>I',head)[0])
+            received = 4 + len(header)
+            header = json.loads(header)
+            sums = {}
+            for index in range(header['blocks']):
+                record = rfile.read(20)
+                sums.setdefault(struct.unpack('>I',record[:4])[0],{})[record[4:]] = index
+            received += 20 * header['blocks']
+            copied = 0
+            digest = hashlib.sha256()
+            with open(src,'rb') as fd:
+                data = mmap.mmap(fd.fileno(),0,access=mmap.ACCESS_READ) if length else b''
+                try:
+                    pending = []
+                    for op in deltaRecipe(data,size,sums):
+                        if op[0] == 'C':
+                            pending.append(b'C' + struct.pack('>II',op[1],op[2]))
+                            copied += op[2] * size
+                        else:
+                            pending.append(b'L' + struct.pack('>I',len(op[1])) + op[1])
+                        if sum(len(x) for x in pending) >= 65536:
+                            writer.write(b''.join(pending))
+                            pending.clear()
+                    digest.update(data)
+                    writer.write(b''.join(pending) + b'E' + digest.digest())
+                finally:
+                    if length: data.close()
+            reply = rfile.read()
+            received += len(reply)
+            reply = json.loads(reply)
+        except (OSError,EOFError,ValueError) as e:
+            ## the helper has failed, report it by its stderr
+            logDebug(f'[transfer] delta uploading failed: {e}')
+            _finishCommand(channel,command,timeout,drainer)
+            raise
+        _finishCommand(channel,command,timeout,drainer)
+    finally:
+        channel.close()
+        scheduler.release(channel)
+    result.add(src,reply['path'],length)
+    result.transferred = writer.sent - len(source) + received
+    result.copied = copied
+    result.elapsed = time.time() - start
+    logDebug(f'[transfer] delta uploaded {result}, {copied} bytes were copied from the remote copy')
+    return result
@@ -0,0 +1,224 @@
+# Copyright (C) 2022-2026  Hsin Yuan Yeh <iapyeh@gmail.com>
+#
+# This file is part of Sshscript.
+#
+# SSHScript is free software; you can redistribute it and/or modify it under the
+# terms of the MIT License.
+#
+# SSHScript is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the MIT License for more details.
+#
+# You should have received a copy of the MIT License along with SSHScript;
+# if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+'''
+Persistent local shells for local one-dollar commands (v2.0.3)
+
+When enabled, a local one-dollar command is not started by subprocess.Popen(),
+it is written to a long-lived shell (bash --norc --noprofile, or sh) instead.
+After the command, the shell prints a delimiter carrying the exitcode to both
+stdout and stderr, so the output of every command is framed without waiting
+for an idle timeout. Idle shells are kept in a pool, so concurrent threads
+have their own shells.
+
+The arguments are quoted by shlex.quote(), so they are passed to the command as
+they were by subprocess.Popen(). Commands run in the shell itself, like subprocess.Popen()
+they honour os.chdir() and os.environ: before a command, the shell is changed to
+the current directory of the python process and gets changes of os.environ, only
+when they have changed since the last command of the shell. Builtins which would
+change the state of the shell (eg. "cd /etc", "export", "exit") run in a subshell,
+so nothing persists to later commands. If os.environ has a name that the shell
+can not export, the command is started by subprocess.Popen() instead.
+Otherwise, a failed command gets exitcode 127 instead of raising FileNotFoundError,
+and the stdin of commands is /dev/null. A shell which was interrupted is replaced
+by a new one.
+
+Environment variables:
+    SSHSCRIPT_LOCAL_WORKER=1          : enable (or $.localworker(True))
+    SSHSCRIPT_LOCAL_WORKER_SIZE=4     : max number of idle shells kept in the pool
+'''
+import os
+import re
+import uuid
+import shlex
+import shutil
+import atexit
+import selectors
+import subprocess
+import threading
+try:
+    from .sshscripterror import logDebug, logDebug8
+    from .sshscriptchannelutils import DelimiterSplitter
+except ImportError:
+    from sshscripterror import logDebug, logDebug8
+    from sshscriptchannelutils import DelimiterSplitter
+
+_validName = re.compile(r'[A-Za-z_][A-Za-z0-9_]*\Z')
+## builtins which change the state of the shell, they are executed in a subshell
+_stateBuiltins = frozenset(('cd','pushd','popd','export','unset','declare','typeset','readonly','local',
+    'set','shopt','source','.','eval','exec','exit','logout','return','alias','unalias','umask','ulimit',
+    'trap','hash','enable','builtin','command','let','read','mapfile','readarray','shift','getopts'))
+
+def _snapshot(environ):
+    ## a copy of os.environ to detect changes, the encoded data of os.environ is copied if possible,
+    ## because dict(os.environ) decodes every item (it was the most costly part of a command)
+    data = getattr(environ,'_data',None)
+    return dict(data) if isinstance(data,dict) else dict(environ)
+
+def enabled():
+    return os.environ.get('SSHSCRIPT_LOCAL_WORKER','') not in ('','0','no','false')
+
+class LocalWorker(object):
+    def __init__(self):
+        shell = shutil.which('bash')
+        args = [shell,'--norc','--noprofile'] if shell else ['/bin/sh']
+        ## the current directory and the environment of the shell, updated by prelude() and execute()
+        self.cwd = os.getcwd()
+        self.environ = _snapshot(os.environ)
+        self._target = None
+        self.process = subprocess.Popen(args,stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.PIPE,
+            env=self.environ,start_new_session=True)
+        self.token = f'__sshscript_{uuid.uuid4().hex}_'
+        self.counter = 0
+        self.exitcode = None
+        logDebug8(f'[worker] {self.process.pid} started')
+
+    def __repr__(self):
+        return f'<LocalWorker {self.process.pid}>'
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def prelude(self,cwd,environ):
+        ## returns commands to run before the next command, for cwd and environ as subprocess.Popen() does,
+        ## "" if the shell is in them already, or None if environ can not be applied by the shell
+        environ = _snapshot(environ)
+        commands = []
+        if environ != self.environ:
+            for name, value in environ.items():
+                if self.environ.get(name) == value: continue
+                name, value = os.fsdecode(name), os.fsdecode(value)
+                if not _validName.match(name): return None
+                commands.append(f'export {name}={shlex.quote(value)}; ')
+            for name in self.environ:
+                if name in environ: continue
+                name = os.fsdecode(name)
+                if not _validName.match(name): return None
+                commands.append(f'unset {name}; ')
+        if cwd != self.cwd:
+            ## the command is skipped if the directory has gone
+            commands.append(f'cd -- {shlex.quote(cwd)} && ')
+        self._target = (cwd,environ)
+        return ''.join(commands)
+
+    def execute(self,args,addStderrData,prelude):
+        ## yields stdout of the command chunk by chunk, stderr is given to addStderrData.
+        ## prelude: returned by self.prelude()
+        ## self.exitcode is assigned when the command has completed.
+        self.counter += 1
+        idx = self.counter
+        self.exitcode = None
+        command = ' '.join(shlex.quote(x) for x in args)
+        if args and (args[0] in _stateBuiltins or (args[0] == 'printf' and '-v' in args)):
+            command = f'( {command} )'
+        line = f"{prelude}{command} </dev/null; __rc=$?; printf '{self.token}{idx}--%d--\\n' $__rc; printf '{self.token}{idx}--%d--\\n' $__rc >&2\n"
+        chunks = []
+        stdoutSplitter = DelimiterSplitter(self.token,chunks.append)
+        stderrSplitter = DelimiterSplitter(self.token,addStderrData)
+        completed = False
+        try:
+            self.process.stdin.write(line.encode('utf8'))
+            self.process.stdin.flush()
+            self.cwd, self.environ = self._target
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.process.stdout,selectors.EVENT_READ,stdoutSplitter)
+                selector.register(self.process.stderr,selectors.EVENT_READ,stderrSplitter)
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        data = os.read(key.fd,65536)
+                        if not data:
+                            ## the shell has exited
+                            selector.unregister(key.fileobj)
+                            continue
+                        splitter = key.data
+                        splitter.feed(data)
+                        if splitter.delimiters:
+                            selector.unregister(key.fileobj)
+                    if chunks:
+                        yield from chunks
+                        chunks.clear()
+            stdoutSplitter.flush()
+            stderrSplitter.flush()
+            if chunks: yield from chunks
+            if stdoutSplitter.delimiters:
+                self.exitcode = stdoutSplitter.delimiters[-1][1]
+                completed = True
+                if self.exitcode != 0 and 'cd -- ' in prelude:
+                    ## "cd" might have failed, change the directory again next time
+                    self.cwd = None
+            else:
+                ## eg. "exit 3"
+                self.exitcode = self.process.wait()
+        finally:
+            if not completed:
+                ## the shell is in unknown state
+                self.close()
+
+    def close(self):
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+        for fd in (self.process.stdin,self.process.stdout,self.process.stderr):
+            try:
+                fd.close()
+            except OSError:
+                pass
+        logDebug8(f'[worker] {self.process.pid} closed')
+
+class LocalWorkerPool(object):
+    def __init__(self,maxSize=4):
+        self.maxSize = maxSize
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._idle)
+
+    def acquire(self):
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive(): return worker
+                worker.close()
+        return LocalWorker()
+
+    def release(self,worker):
+        if worker.alive():
+            with self._lock:
+                if len(self._idle) < self.maxSize:
+                    self._idle.append(worker)
+                    return
+        worker.close()
+
+    def clear(self):
+        with self._lock:
+            workers = self._idle[:]
+            self._idle.clear()
+        for worker in workers:
+            try:
+                worker.close()
+            except Exception as e:
+                logDebug(f'[worker] error on closing {worker}:{e}')
+
+pool = None
+_poolLock = threading.Lock()
+def getPool():
+    global pool
+    with _poolLock:
+        if pool is None:
+            pool = LocalWorkerPool(maxSize=int(os.environ.get('SSHSCRIPT_LOCAL_WORKER_SIZE',4)))
+            atexit.register(pool.clear)
+    return pool